@@ -16,8 +16,15 @@ const App = () => {
 	const [panel, setPanel] = useState("form");
 	const [theme, setTheme] = useState("normal");
 
-	const { treeData, isLoading, error, statusMessage, handleStartAnalysis } =
-		useAnalysis(setPanel);
+	const {
+		treeData,
+		treeVersion,
+		expandNode,
+		isLoading,
+		error,
+		statusMessage,
+		handleStartAnalysis,
+	} = useAnalysis(setPanel);
 
 	const updateGame = (newGame) => setGame(newGame);
 
@@ -94,6 +101,8 @@ const App = () => {
 					<Visibility isVisible={panel == "tree"}>
 						<TreeContainer
 							treeData={treeData}
+							treeVersion={treeVersion}
+							expandNode={expandNode}
 							updateGame={updateGameFromTree}
 						/>
 					</Visibility>
@@ -3,27 +3,33 @@ import React, { useCallback, useEffect, useMemo, useState } from "react";
 import { ReactFlowProvider } from "reactflow";
 import NodeInfo from "./NodeInfo.jsx";
 import TreeView from "./TreeView.jsx";
-import { transformData } from "./utils.js";
+import { findNode, transformData } from "./utils.js";
 
-const TreeContainer = ({ treeData, updateGame }) => {
-	const [selectedNode, setSelectedNode] = useState(null);
+const TreeContainer = ({ treeData, treeVersion, expandNode, updateGame }) => {
+	const [selectedMoves, setSelectedMoves] = useState([]);
 	const [viewKey, setViewKey] = useState(0);
 
 	const { nodes, edges } = useMemo(() => transformData(treeData), [treeData]);
 
+	const selectedNode = useMemo(
+		() => findNode(treeData, selectedMoves) || treeData,
+		[treeData, selectedMoves]
+	);
+
 	useEffect(() => {
-		if (treeData) setSelectedNode(treeData);
+		setSelectedMoves([]);
 		setViewKey((prev) => prev + 1);
-	}, [treeData]);
+	}, [treeVersion]);
 
 	const handleNodeClick = useCallback(
 		(event, node) => {
 			const data = node.data.fullNode;
 			const ancestors = node.data.ancestors;
-			setSelectedNode(data);
+			setSelectedMoves(node.data.moves);
 			updateGame(new Chess(data.fen), ancestors);
+			expandNode(data);
 		},
-		[updateGame]
+		[updateGame, expandNode]
 	);
 
 	if (!selectedNode) {
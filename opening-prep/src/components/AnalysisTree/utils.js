@@ -30,6 +30,11 @@ export const transformData = (rootNode) => {
 			data: {
 				label: d3Node.data.san,
 				fullNode: d3Node.data,
+				moves: d3Node
+					.ancestors()
+					.map((d) => d.data.san)
+					.reverse()
+					.slice(1),
 				ancestors: d3Node
 					.ancestors()
 					.map((d) => {
@@ -59,3 +64,10 @@ export const transformData = (rootNode) => {
 	});
 	return { nodes, edges };
 };
+
+export const findNode = (rootNode, moves) =>
+	moves.reduce(
+		(node, san) =>
+			node && Object.values(node.children || {}).find((child) => child.san === san),
+		rootNode
+	);
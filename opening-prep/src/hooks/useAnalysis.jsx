@@ -4,14 +4,67 @@ import initialTreeData from "../tree.json";
 // const apiUrl = import.meta.env.VITE_API_URL || "";
 const apiUrl = "https://api-g3sc.onrender.com";
 // const apiUrl = "";
+const INITIAL_DEPTH = 3;
+const EXPAND_DEPTH = 2;
+
+const graftSubtree = (node, path, subtree) => {
+	if (path.length === 0) return subtree;
+	return {
+		...node,
+		children: node.children.map((child) =>
+			child.san === path[0]
+				? graftSubtree(child, path.slice(1), subtree)
+				: child
+		),
+	};
+};
 
 export const useAnalysis = (setPanel) => {
 	const [treeData, setTreeData] = useState(initialTreeData);
+	const [treeVersion, setTreeVersion] = useState(0);
+	const [resultId, setResultId] = useState(null);
 	const [jobId, setJobId] = useState(null);
 	const [isLoading, setIsLoading] = useState(false);
 	const [error, setError] = useState(null);
 	const [statusMessage, setStatusMessage] = useState("");
 
+	const finishAnalysis = useCallback(async (id) => {
+		try {
+			const response = await fetch(
+				`${apiUrl}/api/results/${id}/subtree?depth=${INITIAL_DEPTH}`
+			);
+			if (!response.ok) throw new Error("Failed to load analysis result.");
+			const data = await response.json();
+			setResultId(id);
+			setTreeData(data.node);
+			setTreeVersion((prev) => prev + 1);
+			setIsLoading(false);
+			setStatusMessage("Analysis complete! Switching to tree view.");
+			setTimeout(() => {
+				setPanel("tree");
+				setStatusMessage("");
+			}, 1500);
+		} catch (err) {
+			setError(err.message);
+			setIsLoading(false);
+			setStatusMessage("");
+		}
+	}, [setPanel]);
+
+	const expandNode = useCallback(async (node) => {
+		if (!resultId || !(node.child_count > node.children.length)) return;
+		try {
+			const response = await fetch(
+				`${apiUrl}/api/results/${resultId}/subtree?node_id=${node.id}&depth=${EXPAND_DEPTH}`
+			);
+			if (!response.ok) throw new Error("Failed to load more moves.");
+			const data = await response.json();
+			setTreeData((tree) => graftSubtree(tree, node.path, data.node));
+		} catch (err) {
+			setError(err.message);
+		}
+	}, [resultId]);
+
 	const handleStartAnalysis = useCallback(async (requestBody) => {
 		if (!requestBody) {
 			setError("Analysis parameters are missing.");
@@ -23,7 +76,7 @@ export const useAnalysis = (setPanel) => {
 		setStatusMessage("Sending analysis request...");
 
 		try {
-			const response = await fetch(`${apiUrl}/api/analyze`, {
+			const response = await fetch(`${apiUrl}/api/analyze?result=false`, {
 				method: "POST",
 				headers: { "Content-Type": "application/json" },
 				body: JSON.stringify(requestBody),
@@ -37,7 +90,9 @@ export const useAnalysis = (setPanel) => {
 			}
 
 			const data = await response.json();
-			if (data.job_id) {
+			if (data.status === "finished" && data.job_id) {
+				await finishAnalysis(data.job_id);
+			} else if (data.job_id) {
 				setJobId(data.job_id);
 				setStatusMessage(
 					`Job queued! ID: ${data.job_id.substring(0, 8)}...`
@@ -50,54 +105,50 @@ export const useAnalysis = (setPanel) => {
 			setIsLoading(false);
 			setStatusMessage("");
 		}
-	}, []);
+	}, [finishAnalysis]);
 
 	useEffect(() => {
 		if (!jobId || !isLoading) return;
 
-		const pollInterval = setInterval(async () => {
-			try {
-				const response = await fetch(`${apiUrl}/api/results/${jobId}`);
-				if (!response.ok)
-					throw new Error("Failed to fetch job status.");
-
-				const data = await response.json();
-
-				if (data.status === "finished") {
-					clearInterval(pollInterval);
-					setIsLoading(false);
-					setJobId(null);
-					setTreeData(data.result);
-					setStatusMessage(
-						"Analysis complete! Switching to tree view."
-					);
-					setTimeout(() => {
-						setPanel("tree");
-						setStatusMessage("");
-					}, 1500);
-				} else if (data.status === "failed") {
-					clearInterval(pollInterval);
-					setIsLoading(false);
-					setJobId(null);
-					setError(
-						data.error || "Analysis job failed on the server."
-					);
-					setStatusMessage("Job failed.");
-				} else {
-					setStatusMessage(
-						data.progress || "Analysis in progress..."
-					);
-				}
-			} catch (err) {
-				clearInterval(pollInterval);
-				setError(err.message);
+		const events = new EventSource(
+			`${apiUrl}/api/results/${jobId}/events?result=false`
+		);
+
+		events.onmessage = (event) => {
+			const data = JSON.parse(event.data);
+
+			if (data.status === "finished") {
+				events.close();
+				setJobId(null);
+				finishAnalysis(jobId);
+			} else if (data.status === "failed" || data.status === "not_found") {
+				events.close();
 				setIsLoading(false);
-				setStatusMessage("Error checking job status.");
+				setJobId(null);
+				setError(data.error || "Analysis job failed on the server.");
+				setStatusMessage("Job failed.");
+			} else {
+				setStatusMessage(data.progress || "Analysis in progress...");
 			}
-		}, 3000);
+		};
+
+		events.onerror = () => {
+			if (events.readyState !== EventSource.CLOSED) return;
+			setError("Lost connection to the analysis server.");
+			setIsLoading(false);
+			setStatusMessage("Error checking job status.");
+		};
 
-		return () => clearInterval(pollInterval);
-	}, [jobId, isLoading, setPanel]);
+		return () => events.close();
+	}, [jobId, isLoading, finishAnalysis]);
 
-	return { treeData, isLoading, error, statusMessage, handleStartAnalysis };
+	return {
+		treeData,
+		treeVersion,
+		expandNode,
+		isLoading,
+		error,
+		statusMessage,
+		handleStartAnalysis,
+	};
 };
@@ -0,0 +1,123 @@
+import argparse
+import time
+import chess
+from build_tree import read_pgn_moves
+from features import BOARD_FEATURES, FEATURE_ORDER, board_feature_values, extract_features
+from benchmarks.fixtures import synthetic_games, read_pgn_file
+
+PVAL = {
+    chess.PAWN: 1,
+    chess.KNIGHT: 3,
+    chess.BISHOP: 3,
+    chess.ROOK: 5,
+    chess.QUEEN: 9
+}
+
+def material(board):
+    w_mat = sum(len(board.pieces(type, chess.WHITE)) * val for type, val in PVAL.items())
+    b_mat = sum(len(board.pieces(type, chess.BLACK)) * val for type, val in PVAL.items())
+    return (w_mat, b_mat)
+
+def king_safety(board, color):
+    ksq = board.king(color)
+    opp = not color
+    pawns = board.pieces(chess.PAWN, color)
+    opp_pawns = board.pieces(chess.PAWN, opp)
+    f, r = chess.square_file(ksq), chess.square_rank(ksq)
+    files = [x for x in (f-1, f, f+1) if 0 <= x < 8]
+    ranks = [r+1, r+2] if color == chess.WHITE else [r-1, r-2]
+    ranks = [x for x in ranks if 0 <= x < 8]
+    shield_mask = sum(chess.BB_FILES[ff] & chess.BB_RANKS[rr] for ff in files for rr in ranks)
+    shield_pawns = pawns & chess.SquareSet(shield_mask)
+    shield_score = min(len(shield_pawns), 3)
+    kfile = chess.BB_FILES[f]
+    if pawns & chess.SquareSet(kfile): file_score = 2
+    elif opp_pawns & chess.SquareSet(kfile): file_score = 1
+    else: file_score = 0
+    zone = chess.BB_KING_ATTACKS[ksq] | (1 << ksq)
+    attacks_by_opp = sum(board.is_attacked_by(opp, sq) for sq in chess.SquareSet(zone))
+    zone_score = max(0, 3 - attacks_by_opp)
+    return shield_score + file_score + zone_score
+
+def doubled_pawns(board, color):
+    pawns = board.pieces(chess.PAWN, color)
+    return sum(bin(pawns & chess.BB_FILES[f]).count("1") - 1 
+               for f in range(8) if pawns & chess.BB_FILES[f])
+
+def isolated_pawns(board, color):
+    pawns = board.pieces(chess.PAWN, color)
+    count = 0
+    for f in range(8):
+        if pawns & chess.BB_FILES[f]:
+            adj = ((chess.BB_FILES[f-1] if f > 0 else 0) |
+                   (chess.BB_FILES[f+1] if f < 7 else 0))
+            if not (pawns & adj): count += bin(pawns & chess.BB_FILES[f]).count("1")
+    return count
+
+def passed_pawns(board, color):
+    pawns, opp_pawns = board.pieces(chess.PAWN, color), board.pieces(chess.PAWN, not color)
+    count = 0
+    for sq in pawns:
+        f = chess.square_file(sq)
+        adj_files = [f] + ([f-1] if f > 0 else []) + ([f+1] if f < 7 else [])
+        if color == chess.WHITE:
+            ahead = sum(chess.BB_FILES[a] & chess.BB_RANKS[r] for a in adj_files for r in range(chess.square_rank(sq)+1, 8))
+        else:
+            ahead = sum(chess.BB_FILES[a] & chess.BB_RANKS[r] for a in adj_files for r in range(chess.square_rank(sq)))
+        if not (opp_pawns & ahead): count += 1
+    return count
+
+def mobility(board):
+    return board.legal_moves.count()
+
+def reference_values(board):
+    features = {}
+    features['white_material'], features['black_material'] = material(board)
+    for color, suffix in ((chess.WHITE, 'w'), (chess.BLACK, 'b')):
+        features[f'isolated_pawns_{suffix}'] = isolated_pawns(board, color)
+        features[f'doubled_pawns_{suffix}'] = doubled_pawns(board, color)
+        features[f'passed_pawns_{suffix}'] = passed_pawns(board, color)
+        features[f'king_safety_{suffix}'] = king_safety(board, color)
+    features['mobility'] = mobility(board)
+    features['white_castle_kingside'] = bool(board.castling_rights & chess.BB_H1)
+    features['white_castle_queenside'] = bool(board.castling_rights & chess.BB_A1)
+    features['black_castle_kingside'] = bool(board.castling_rights & chess.BB_H8)
+    features['black_castle_queenside'] = bool(board.castling_rights & chess.BB_A8)
+    return tuple(features[name] for name in BOARD_FEATURES)
+
+def collect_boards(games, depth):
+    boards = []
+    for pgn in games:
+        board = chess.Board()
+        for san, _ in read_pgn_moves(pgn, depth)[1]:
+            board.push_san(san)
+            boards.append(board.copy(stack=False))
+    return boards
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Check and time bitboard feature extraction against the reference functions.")
+    parser.add_argument('--pgn', help="PGN export to sample positions from (defaults to synthetic games)")
+    parser.add_argument('--games', type=int, default=200)
+    parser.add_argument('--depth', type=int, default=60)
+    args = parser.parse_args()
+
+    boards = collect_boards(read_pgn_file(args.pgn) if args.pgn else synthetic_games(args.games), args.depth)
+    reference, reference_time = timed(lambda: [reference_values(board) for board in boards])
+    values, values_time = timed(lambda: [board_feature_values(board) for board in boards])
+    matrix, matrix_time = timed(lambda: extract_features(boards))
+    mismatches = [board.fen() for board, a, b in zip(boards, reference, values) if a != b]
+    columns = [FEATURE_ORDER.index(feature) for feature in BOARD_FEATURES]
+    matrix_ok = all((matrix[i, columns] == row).all() for i, row in enumerate(reference))
+    print(f"positions: {len(boards)}")
+    print(f"reference:  {reference_time:8.3f}s  {len(boards) / reference_time:10.0f} boards/s")
+    print(f"bitboard:   {values_time:8.3f}s  {len(boards) / values_time:10.0f} boards/s")
+    print(f"matrix:     {matrix_time:8.3f}s  {len(boards) / matrix_time:10.0f} boards/s")
+    print(f"speedup:    {reference_time / values_time:8.1f}x")
+    print(f"parity: {not mismatches and matrix_ok} ({len(mismatches)} mismatches)")
+    for fen in mismatches[:10]: print(f"  {fen}")
+    if mismatches or not matrix_ok: raise SystemExit(1)
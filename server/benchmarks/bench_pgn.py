@@ -0,0 +1,31 @@
+import argparse
+import time
+from build_tree import ChessNode, START_FEN, add_game_to_tree, add_pgn_to_tree
+from benchmarks.fixtures import synthetic_games, read_pgn_file
+
+def build(add_game, games, depth):
+    root = ChessNode(START_FEN, 'root', 'root')
+    start = time.perf_counter()
+    for pgn in games: add_game(root, pgn, depth)
+    return root, time.perf_counter() - start
+
+def same_tree(a, b):
+    if (a.fen, a.uci, a.res, a.occ) != (b.fen, b.uci, b.res, b.occ): return False
+    if a.children.keys() != b.children.keys(): return False
+    return all(same_tree(child, b.children[san]) for san, child in a.children.items())
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare chess.pgn ingest with the streaming SAN parser.")
+    parser.add_argument('--pgn', help="PGN export to ingest (defaults to synthetic games)")
+    parser.add_argument('--games', type=int, default=2000)
+    parser.add_argument('--depth', type=int, default=20)
+    args = parser.parse_args()
+
+    games = read_pgn_file(args.pgn) if args.pgn else synthetic_games(args.games)
+    legacy_tree, legacy_time = build(add_game_to_tree, games, args.depth)
+    fast_tree, fast_time = build(add_pgn_to_tree, games, args.depth)
+    print(f"games: {len(games)}, depth: {args.depth}")
+    print(f"chess.pgn:  {legacy_time:8.3f}s  {len(games) / legacy_time:10.0f} games/s")
+    print(f"streaming:  {fast_time:8.3f}s  {len(games) / fast_time:10.0f} games/s")
+    print(f"speedup:    {legacy_time / fast_time:8.1f}x")
+    print(f"trees match: {same_tree(legacy_tree, fast_tree)}")
@@ -0,0 +1,87 @@
+import argparse
+import os
+import platform
+import sys
+import time
+import numpy as np
+import build_tree
+from build_tree import ENGINE_POOL_SIZE, SCRIPT_DIR, EnginePool, get_onnx_session, run_analysis
+from metrics import JobMetrics
+from benchmarks.lichess_stub import GameLibrary, start_stub
+
+PHASES = ('ingest', 'intersect', 'engine', 'inference')
+FAKE_ENGINE = [sys.executable, os.path.join(SCRIPT_DIR, 'benchmarks', 'fake_engine.py')]
+BUNDLED_ENGINES = {'x86_64': 'stockfish_amd64', 'amd64': 'stockfish_amd64', 'aarch64': 'stockfish_arm64', 'arm64': 'stockfish_arm64'}
+
+class StandInInput:
+    name = 'input'
+
+class StandInSession:
+    def get_inputs(self): return [StandInInput()]
+
+    def run(self, outputs, feeds):
+        rows = len(next(iter(feeds.values())))
+        return [None, np.full((rows, 3), 1 / 3, dtype=np.float32)]
+
+def engine_command(engine):
+    if engine == 'fake': return FAKE_ENGINE
+    return os.path.join(SCRIPT_DIR, BUNDLED_ENGINES[platform.machine().lower()])
+
+def player_filters(color, games):
+    return {'color': color, 'rated': True, 'clocks': True, 'max': games, 'perfType': 'bullet,blitz,rapid,classical'}
+
+def run(args, pool, session, games, depth, threshold):
+    metrics = JobMetrics(track_memory=args.memory)
+    start = time.perf_counter()
+    run_analysis(args.players[0], args.players[1], player_filters('white', games), player_filters('black', games),
+                 threshold, depth, session, transpositions=args.transpositions, update_progress=lambda m: None,
+                 metrics=metrics, pool=pool, budget=args.engine_budget)
+    metrics.add('job_seconds', time.perf_counter() - start)
+    return metrics.summary()
+
+def report(games, depth, threshold, values, memory):
+    phases = "  ".join(f"{phase} {values.get(f'{phase}_seconds', 0):7.3f}s" for phase in PHASES)
+    print(f"games {games:6d}  depth {depth:3d}  threshold {threshold:5.2f}  "
+          f"nodes {values.get('tree_nodes', 0):8d}  shared {values.get('intersected_nodes', 0):6d}  "
+          f"{phases}  total {values['job_seconds']:7.3f}s  {values.get('games_per_second', 0):8.0f} games/s")
+    if memory:
+        peaks = "  ".join(f"{phase} {values.get(f'{phase}_peak_rss_mb', 0):7.1f}MB" for phase in PHASES)
+        print(f"{'':58s}peak  {peaks}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run the analysis pipeline end to end against a local Lichess stand-in.")
+    parser.add_argument('--players', nargs=2, default=['DrNykterstein', 'EricRosen'])
+    parser.add_argument('--pgn-dir', help="Directory of recorded <player>.pgn exports (defaults to synthetic games)")
+    parser.add_argument('--sizes', default='1000,5000,20000', help="Games per player, comma separated")
+    parser.add_argument('--depths', default='10,20')
+    parser.add_argument('--thresholds', default='0.05,0.15,0.3')
+    parser.add_argument('--engine', choices=('fake', 'bundled'), default='fake')
+    parser.add_argument('--engine-budget', type=float, default=10)
+    parser.add_argument('--pool-size', type=int, default=ENGINE_POOL_SIZE)
+    parser.add_argument('--model', help="ONNX model to use (defaults to the bundled one)")
+    parser.add_argument('--stand-in-model', action='store_true', help="Predict uniform probabilities instead of loading ONNX")
+    parser.add_argument('--transpositions', action='store_true')
+    parser.add_argument('--memory', action=argparse.BooleanOptionalAction, default=True,
+                        help="Record the peak RSS of each phase (Linux only)")
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+    depths = [int(depth) for depth in args.depths.split(',')]
+    thresholds = [float(threshold) for threshold in args.thresholds.split(',')]
+    library = GameLibrary(args.pgn_dir, 2 * max(sizes))
+    for player in args.players: library.get(player)
+    server, url = start_stub(library)
+    build_tree.LICHESS_URL = url
+    if args.stand_in_model: session = StandInSession()
+    else: session = get_onnx_session(args.model) if args.model else get_onnx_session()
+    pool = EnginePool(engine_command(args.engine), args.pool_size)
+    print(f"engine: {args.engine} x{pool.size}, budget {args.engine_budget}s, "
+          f"model: {'stand-in' if args.stand_in_model else args.model or 'bundled'}, peak rss: {args.memory}")
+    try:
+        for games in sizes:
+            for depth in depths:
+                for threshold in thresholds:
+                    report(games, depth, threshold, run(args, pool, session, games, depth, threshold), args.memory)
+    finally:
+        pool.close()
+        server.shutdown()
@@ -0,0 +1,46 @@
+import argparse
+import time
+import chess
+import onnxruntime as ort
+from build_tree import (ONNX_MODEL_PATH, STOCKFISH_EXECUTABLE_PATH, ENGINE_POOL_SIZE, EnginePool,
+                        get_engine_pool, get_onnx_session)
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+def cold_job(model_path, stockfish_path, pool_size):
+    _, onnx_time = timed(lambda: ort.InferenceSession(model_path))
+    pool, engine_time = timed(lambda: EnginePool(stockfish_path, pool_size))
+    _, first_time = timed(lambda: pool.run(lambda engine: engine.analyse(chess.Board(), chess.engine.Limit(depth=1))))
+    pool.close()
+    return onnx_time, engine_time + first_time
+
+def warm_job(model_path, stockfish_path, pool_size):
+    _, onnx_time = timed(lambda: get_onnx_session(model_path))
+    pool, engine_time = timed(lambda: get_engine_pool(stockfish_path, pool_size))
+    _, first_time = timed(lambda: pool.run(lambda engine: engine.analyse(chess.Board(), chess.engine.Limit(depth=1))))
+    return onnx_time, engine_time + first_time
+
+def report(name, runs):
+    onnx = sum(run[0] for run in runs) / len(runs)
+    engines = sum(run[1] for run in runs) / len(runs)
+    print(f"{name:6s} onnx {onnx:8.3f}s  engines {engines:8.3f}s  total {onnx + engines:8.3f}s per job")
+    return onnx + engines
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare per-job startup of a forking worker with the warm worker.")
+    parser.add_argument('--model', default=ONNX_MODEL_PATH)
+    parser.add_argument('--stockfish', default=STOCKFISH_EXECUTABLE_PATH)
+    parser.add_argument('--pool-size', type=int, default=ENGINE_POOL_SIZE)
+    parser.add_argument('--jobs', type=int, default=5)
+    args = parser.parse_args()
+
+    cold = [cold_job(args.model, args.stockfish, args.pool_size) for _ in range(args.jobs)]
+    _, warm_up = timed(lambda: warm_job(args.model, args.stockfish, args.pool_size))
+    warm = [warm_job(args.model, args.stockfish, args.pool_size) for _ in range(args.jobs)]
+    get_engine_pool(args.stockfish, args.pool_size).close()
+    print(f"jobs: {args.jobs}, engines: {args.pool_size}, one-time warm-up: {warm_up:.3f}s")
+    saved = report("fork", cold) - report("warm", warm)
+    print(f"saved:      {saved:8.3f}s per job")
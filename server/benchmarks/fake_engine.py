@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+import sys
+import chess
+
+def evaluate(board, depth):
+    score = sum(map(ord, board.board_fen())) % 97 - 48
+    return score if depth == '0' else score * 2
+
+def main():
+    board = chess.Board()
+    for line in sys.stdin:
+        cmd = line.split()
+        if not cmd: continue
+        if cmd[0] == 'uci':
+            print('id name FakeEngine')
+            print('option name Threads type spin default 1 min 1 max 512')
+            print('option name Hash type spin default 16 min 1 max 33554432')
+            print('uciok')
+        elif cmd[0] == 'isready': print('readyok')
+        elif cmd[0] == 'position':
+            board = chess.Board() if cmd[1] == 'startpos' else chess.Board(' '.join(cmd[2:8]))
+            if 'moves' in cmd:
+                for uci in cmd[cmd.index('moves') + 1:]: board.push_uci(uci)
+        elif cmd[0] == 'go':
+            moves = sorted(move.uci() for move in board.legal_moves)
+            depth = cmd[cmd.index('depth') + 1] if 'depth' in cmd else None
+            if moves:
+                print(f'info depth 1 score cp {evaluate(board, depth)} pv {moves[0]}')
+                print(f'bestmove {moves[0]}')
+            else:
+                print('info depth 0 score mate 0')
+                print('bestmove (none)')
+        elif cmd[0] == 'quit': break
+        sys.stdout.flush()
+
+if __name__ == '__main__':
+    main()
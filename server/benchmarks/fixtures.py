@@ -0,0 +1,54 @@
+import random
+import zlib
+import chess
+from datetime import datetime, timezone
+from build_tree import pgn_file_generator
+
+START_TIMESTAMP = 1700000000
+PERF_TYPES = [("Bullet", "60+0"), ("Blitz", "180+2"), ("Blitz", "300+0"), ("Rapid", "600+5"), ("Classical", "1800+20")]
+NAMES = ["DrNykterstein", "EricRosen", "Zhigalko_Sergei", "Jospem", "Ødegaard", "Mañana_Gambit", "Дмитрий", "penguingim1"]
+
+def synthetic_game(rnd, index, min_plies=30, max_plies=90, players=None):
+    board, moves = chess.Board(), []
+    perf, tc = rnd.choice(PERF_TYPES)
+    base, inc = (int(x) for x in tc.split('+'))
+    clocks = [base, base]
+    for ply in range(rnd.randint(min_plies, max_plies)):
+        legal = sorted(board.legal_moves, key=lambda m: m.uci())
+        if not legal: break
+        move = legal[min(int(rnd.expovariate(0.8)), len(legal) - 1)]
+        san = board.san(move)
+        board.push(move)
+        side = ply % 2
+        clocks[side] = max(0, clocks[side] - rnd.randint(0, max(1, base // 40)) + inc)
+        clk = f"{clocks[side] // 3600}:{clocks[side] // 60 % 60:02d}:{clocks[side] % 60:02d}"
+        number = f"{ply // 2 + 1}. " if side == 0 else f"{ply // 2 + 1}... "
+        moves.append(f"{number}{san} {{ [%clk {clk}] }}")
+    result = rnd.choice(["1-0", "0-1", "1/2-1/2"])
+    played = datetime.fromtimestamp(START_TIMESTAMP + index * 600, timezone.utc)
+    white, black = players or rnd.sample(NAMES, 2)
+    headers = [
+        ("Event", f"Rated {perf} game"), ("Site", f"https://lichess.org/{index:08x}"),
+        ("White", white), ("Black", black), ("Result", result),
+        ("UTCDate", played.strftime("%Y.%m.%d")), ("UTCTime", played.strftime("%H:%M:%S")),
+        ("WhiteElo", str(rnd.randint(1200, 2900))), ("BlackElo", str(rnd.randint(1200, 2900))),
+        ("Variant", "Standard"), ("TimeControl", tc), ("Termination", "Normal"),
+    ]
+    header_text = "\n".join(f'[{key} "{value}"]' for key, value in headers)
+    return f"{header_text}\n\n{' '.join(moves)} {result}"
+
+def synthetic_games(n, seed=0):
+    rnd = random.Random(seed)
+    return [synthetic_game(rnd, i) for i in range(n)]
+
+def player_games(player, n, seed=0):
+    rnd = random.Random(seed + zlib.crc32(player.lower().encode()))
+    opponents = [name for name in NAMES if name.lower() != player.lower()]
+    games = []
+    for i in range(n):
+        opponent = rnd.choice(opponents)
+        games.append(synthetic_game(rnd, i, players=(player, opponent) if i % 2 == 0 else (opponent, player)))
+    return games
+
+def read_pgn_file(path):
+    return list(pgn_file_generator(path))
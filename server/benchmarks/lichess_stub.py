@@ -0,0 +1,101 @@
+import argparse
+import os
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from build_tree import GAME_SEPARATOR, HEADER_RE, game_timestamp
+from benchmarks.fixtures import player_games, read_pgn_file
+
+EXPORT_PATH_RE = re.compile(r'/api/games/user/([^/]+)')
+CLOCK_COMMENT_RE = re.compile(r' \{ \[%clk [^\]]*\] \}')
+STUB_CHUNK_SIZE = 16 * 1024
+
+class GameLibrary:
+    def __init__(self, pgn_dir=None, games_per_player=1000, seed=0):
+        self.pgn_dir = pgn_dir
+        self.games_per_player = games_per_player
+        self.seed = seed
+        self.lock = threading.Lock()
+        self.games = {}
+
+    def get(self, player):
+        with self.lock:
+            if player.lower() not in self.games: self.games[player.lower()] = self.load(player)
+            return self.games[player.lower()]
+
+    def load(self, player):
+        path = os.path.join(self.pgn_dir, f"{player}.pgn") if self.pgn_dir else None
+        if path and os.path.exists(path): pgns = read_pgn_file(path)
+        else: pgns = player_games(player, self.games_per_player, self.seed)
+        games = [(dict(HEADER_RE.findall(pgn)), pgn) for pgn in pgns]
+        games.sort(key=lambda game: game_timestamp(game[0]), reverse=True)
+        return games
+
+def matches(headers, player, query):
+    color = query.get('color')
+    if color and headers.get(color.capitalize(), '').lower() != player.lower(): return False
+    event = headers.get('Event', '').split()
+    if 'rated' in query and (event[:1] == ['Rated']) != (query['rated'].lower() == 'true'): return False
+    perf_types = query.get('perfType')
+    if perf_types and (len(event) < 2 or event[1].lower() not in perf_types.split(',')): return False
+    played = game_timestamp(headers)
+    if 'since' in query and played < int(query['since']): return False
+    if 'until' in query and played > int(query['until']): return False
+    return True
+
+def iter_export(games, player, query):
+    limit = int(query['max']) if 'max' in query else None
+    clocks = query.get('clocks', 'true').lower() == 'true'
+    buffer, sent = bytearray(), 0
+    for headers, pgn in games:
+        if limit is not None and sent >= limit: break
+        if not matches(headers, player, query): continue
+        buffer += (pgn if clocks else CLOCK_COMMENT_RE.sub('', pgn)).encode() + GAME_SEPARATOR
+        sent += 1
+        if len(buffer) >= STUB_CHUNK_SIZE:
+            yield bytes(buffer)
+            buffer.clear()
+    if buffer: yield bytes(buffer)
+
+class LichessHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        match = EXPORT_PATH_RE.fullmatch(url.path)
+        if not match:
+            self.send_error(404)
+            return
+        player = match.group(1)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        games = self.server.library.get(player)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-chess-pgn')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        for chunk in iter_export(games, player, query):
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+        self.wfile.write(b"0\r\n\r\n")
+
+    def log_message(self, format, *args): pass
+
+def start_stub(library, host='127.0.0.1', port=0):
+    server = ThreadingHTTPServer((host, port), LichessHandler)
+    server.daemon_threads = True
+    server.library = library
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_port}"
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Serve recorded or synthetic PGN exports on the Lichess game export API.")
+    parser.add_argument('--pgn-dir', help="Directory of <player>.pgn exports (players without one get synthetic games)")
+    parser.add_argument('--games', type=int, default=1000, help="Synthetic games per player")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer((args.host, args.port), LichessHandler)
+    server.library = GameLibrary(args.pgn_dir, args.games)
+    print(f"Serving on http://{args.host}:{server.server_port} (set LICHESS_URL to use it)")
+    server.serve_forever()
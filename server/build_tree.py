@@ -1,90 +1,120 @@
 import chess
 import chess.pgn
 import chess.engine
+import chess.polyglot
 import requests
 import io
 import json
+import math
 import os
+import mmap
+import pickle
+import queue
+import re
+import threading
+import time
+import uuid
+import zlib
 import onnxruntime as ort
 import numpy as np
-from rq import get_current_job
-from datetime import datetime
-
-PVAL = {
-    chess.PAWN: 1,
-    chess.KNIGHT: 3,
-    chess.BISHOP: 3,
-    chess.ROOK: 5,
-    chess.QUEEN: 9
-}
+from array import array
+from collections import Counter
+from functools import lru_cache
+from requests.adapters import HTTPAdapter
+from rq import Queue, get_current_job
+from rq.job import Dependency, Job
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+from features import FEATURE_ORDER, extract_features
+from position_cache import get_position_cache, position_key
+from tree_store import get_tree_store
+from result_store import get_result_store
+from progress import publish_progress
+from metrics import JobMetrics, record_job
 
 SCRIPT_DIR = os.path.dirname(os.path.realpath(__file__))
 STOCKFISH_EXECUTABLE_PATH = "/usr/local/bin/stockfish"
+LICHESS_URL = os.getenv('LICHESS_URL', 'https://lichess.org')
+LICHESS_TIMEOUT = (10, 120)
+LICHESS_RETRIES = int(os.getenv('LICHESS_RETRIES', 5))
+LICHESS_RATE_LIMIT_WAIT = 60
+LICHESS_BACKOFF_MAX = 60
 ONNX_MODEL_PATH = os.path.join(SCRIPT_DIR, "chess_predictor_final.onnx")
+START_FEN = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
+ENGINE_POOL_SIZE = int(os.getenv('ENGINE_POOL_SIZE', os.cpu_count() or 1))
+ENGINE_THREADS = int(os.getenv('ENGINE_THREADS', 1))
+ENGINE_HASH_MB = int(os.getenv('ENGINE_HASH_MB', 64))
+ENGINE_TIME_BUDGET = float(os.getenv('ENGINE_TIME_BUDGET', 120))
+ENGINE_NODE_TIME = float(os.getenv('ENGINE_NODE_TIME', 0.2))
+ENGINE_MIN_TIME = 0.05
+ENGINE_MAX_TIME = 1.0
+ENGINE_PLY_DECAY = 0.95
+ONNX_INTRA_OP_THREADS = int(os.getenv('ONNX_INTRA_OP_THREADS', 0))
+WORKER_MODE = os.getenv('WORKER_MODE', 'fork')
+ENGINE_BATCH_SIZE = int(os.getenv('ENGINE_BATCH_SIZE', 0))
+ANALYSIS_STATE_TTL = 60 * 60
+PROGRESS_INTERVAL = 1000
+NAN = float('nan')
+PGN_CHUNK_SIZE = int(os.getenv('PGN_CHUNK_SIZE', 64 * 1024))
+GAME_SEPARATOR = b"\n\n\n"
+HEADER_RE = re.compile(r'^\[(\w+)\s+"(.*)"\]\s*$', re.MULTILINE)
+MOVETEXT_RE = re.compile(r'\{([^}]*)\}|;[^\n]*|\$\d+|[()]|[^\s(){};$]+')
+CLOCK_RE = re.compile(r'\[%clk\s+(\d+):(\d+):(\d+(?:\.\d*)?)\]')
+RESULTS = {"1-0", "0-1", "1/2-1/2", "*"}
+ANALYSIS_FAILED_MESSAGE = "Analysis failed on the server, please retry."
+LICHESS_FAILED_MESSAGE = "Lost the connection to Lichess while downloading games, please retry."
 
-def material(board):
-    w_mat = sum(len(board.pieces(type, chess.WHITE)) * val for type, val in PVAL.items())
-    b_mat = sum(len(board.pieces(type, chess.BLACK)) * val for type, val in PVAL.items())
-    return (w_mat, b_mat)
-
-def king_safety(board, color):
-    ksq = board.king(color)
-    opp = not color
-    pawns = board.pieces(chess.PAWN, color)
-    opp_pawns = board.pieces(chess.PAWN, opp)
-    f, r = chess.square_file(ksq), chess.square_rank(ksq)
-    files = [x for x in (f-1, f, f+1) if 0 <= x < 8]
-    ranks = [r+1, r+2] if color == chess.WHITE else [r-1, r-2]
-    ranks = [x for x in ranks if 0 <= x < 8]
-    shield_mask = sum(chess.BB_FILES[ff] & chess.BB_RANKS[rr] for ff in files for rr in ranks)
-    shield_pawns = pawns & chess.SquareSet(shield_mask)
-    shield_score = min(len(shield_pawns), 3)
-    kfile = chess.BB_FILES[f]
-    if pawns & chess.SquareSet(kfile): file_score = 2
-    elif opp_pawns & chess.SquareSet(kfile): file_score = 1
-    else: file_score = 0
-    zone = chess.BB_KING_ATTACKS[ksq] | (1 << ksq)
-    attacks_by_opp = sum(board.is_attacked_by(opp, sq) for sq in chess.SquareSet(zone))
-    zone_score = max(0, 3 - attacks_by_opp)
-    return shield_score + file_score + zone_score
-
-def doubled_pawns(board, color):
-    pawns = board.pieces(chess.PAWN, color)
-    return sum(bin(pawns & chess.BB_FILES[f]).count("1") - 1 
-               for f in range(8) if pawns & chess.BB_FILES[f])
-
-def isolated_pawns(board, color):
-    pawns = board.pieces(chess.PAWN, color)
-    count = 0
-    for f in range(8):
-        if pawns & chess.BB_FILES[f]:
-            adj = ((chess.BB_FILES[f-1] if f > 0 else 0) |
-                   (chess.BB_FILES[f+1] if f < 7 else 0))
-            if not (pawns & adj): count += bin(pawns & chess.BB_FILES[f]).count("1")
-    return count
-
-def passed_pawns(board, color):
-    pawns, opp_pawns = board.pieces(chess.PAWN, color), board.pieces(chess.PAWN, not color)
-    count = 0
-    for sq in pawns:
-        f = chess.square_file(sq)
-        adj_files = [f] + ([f-1] if f > 0 else []) + ([f+1] if f < 7 else [])
-        if color == chess.WHITE:
-            ahead = sum(chess.BB_FILES[a] & chess.BB_RANKS[r] for a in adj_files for r in range(chess.square_rank(sq)+1, 8))
-        else:
-            ahead = sum(chess.BB_FILES[a] & chess.BB_RANKS[r] for a in adj_files for r in range(chess.square_rank(sq)))
-        if not (opp_pawns & ahead): count += 1
-    return count
+@lru_cache(maxsize=None)
+def parse_time_control(tc):
+    simple_tc = tc.split('/')[-1].split(':')[0].split('+')
+    base = int(simple_tc[0])
+    inc = int(simple_tc[-1]) if len(simple_tc) > 1 else 0
+    return base, inc
+
+class Occurrences:
+    __slots__ = ('data',)
+    FIELDS = ('w_elo', 'b_elo', 'w_clock', 'b_clock', 'base', 'inc')
+
+    def __init__(self):
+        self.data = array('f')
+
+    def append(self, w_elo, b_elo, w_clock, b_clock, tc):
+        base, inc = parse_time_control(tc)
+        self.data.extend((
+            int(w_elo), int(b_elo),
+            NAN if w_clock is None else w_clock,
+            NAN if b_clock is None else b_clock,
+            base, inc
+        ))
+
+    def columns(self):
+        table = np.frombuffer(self.data, dtype=np.float32).reshape(-1, len(self.FIELDS))
+        return {name: table[:, i] for i, name in enumerate(self.FIELDS)}
 
-def mobility(board):
-    return board.legal_moves.count()
+    def rows(self):
+        data, size = self.data.tobytes(), self.data.itemsize * len(self.FIELDS)
+        return [data[i:i+size] for i in range(0, len(data), size)]
+
+    def remove(self, other):
+        drop, kept = Counter(other.rows()), []
+        for row in self.rows():
+            if drop[row]: drop[row] -= 1
+            else: kept.append(row)
+        self.data = array('f', b''.join(kept))
+
+    def __len__(self): return len(self.data) // len(self.FIELDS)
+
+    def __eq__(self, other): return self.data.tobytes() == other.data.tobytes()
 
 class ChessNode:
-    def __init__(self, fen, san, uci):
-        self.fen = fen
+    __slots__ = ('_fen', 'parent', 'san', 'uci', 'occ', 'res', 'children')
+
+    def __init__(self, fen, san, uci, parent=None):
+        self._fen = fen
+        self.parent = parent
         self.san = san
         self.uci = uci
-        self.occ = []
+        self.occ = Occurrences()
         self.res = {'w_wins': 0, 'b_wins': 0, 'draws': 0}
         self.children = {}
     
@@ -92,12 +122,21 @@ class ChessNode:
         if result == "1-0": self.add_w_win()
         elif result == "0-1": self.add_b_win()
         if result == "1/2-1/2": self.add_draw()
-        self.occ.append({
-            "w_elo": w_elo, "b_elo": b_elo,
-            "w_clock": w_clock, "b_clock": b_clock,
-            "tc": tc
-        })
+        self.occ.append(w_elo, b_elo, w_clock, b_clock, tc)
     
+    @property
+    def fen(self):
+        if self._fen is None:
+            board = chess.Board(self.parent.fen)
+            board.push(chess.Move.from_uci(self.uci))
+            self._fen = board.fen()
+        return self._fen
+
+    def remove_result(self, result):
+        if result == "1-0": self.res["w_wins"] -= 1
+        elif result == "0-1": self.res["b_wins"] -= 1
+        if result == "1/2-1/2": self.res["draws"] -= 1
+
     def add_w_win(self): self.res["w_wins"] += 1
     
     def add_b_win(self): self.res["b_wins"] += 1
@@ -117,12 +156,13 @@ class SharedNode:
         self.uci = uci
         self.p1_res = {"w_wins": 0, "b_wins": 0, "draws": 0}
         self.p2_res = {"w_wins": 0, "b_wins": 0, "draws": 0}
-        self.p1_occ = []
-        self.p2_occ = []
+        self.p1_occ = Occurrences()
+        self.p2_occ = Occurrences()
         self.children = {}
         self.features = {}
         self.rates = {'w': 1, 'b': 1}
         self.counts = {'p1': 0, 'p2': 0}
+        self.position = None
     
     def get_count(self, player):
         return self.counts[player]
@@ -137,45 +177,220 @@ class SharedNode:
         child.counts['p2'] = p2_child.get_count()
         return child
 
-def build_intersected_tree(p1, p2, p1_filters, p2_filters, threshold, depth, token, update_progress):
-    update_progress("Starting Stream for Player 1...")
-    p1_stream = get_game_stream(p1, p1_filters, token)
-    update_progress("Building Tree for Player 1...")
-    p1_tree = get_tree_from_stream(p1_stream, depth)
-    update_progress("Starting Stream for Player 2...")
-    p2_stream = get_game_stream(p2, p2_filters, token)
-    update_progress("Building Tree for Player 2...")
-    p2_tree = get_tree_from_stream(p2_stream, depth)
-    if not p1_tree or not p2_tree: return {"error": "Could not build tree."}
+class PositionNode:
+    __slots__ = ('key', 'sources', 'moves', '_occ', '_res')
+
+    def __init__(self, key):
+        self.key = key
+        self.sources = []
+        self.moves = {}
+        self._occ = None
+        self._res = None
+
+    @property
+    def fen(self): return self.sources[0].fen
+
+    @property
+    def occ(self):
+        if self._occ is None:
+            if len(self.sources) == 1: self._occ = self.sources[0].occ
+            else:
+                self._occ = Occurrences()
+                for source in self.sources: self._occ.data.extend(source.occ.data)
+        return self._occ
+
+    @property
+    def res(self):
+        if self._res is None:
+            if len(self.sources) == 1: self._res = self.sources[0].res
+            else: self._res = {result: sum(source.res[result] for source in self.sources)
+                               for result in ('w_wins', 'b_wins', 'draws')}
+        return self._res
+
+    def get_count(self): return sum(source.get_count() for source in self.sources)
+
+class AnalysisError(Exception): pass
+
+def build_intersected_tree(p1, p2, p1_filters, p2_filters, threshold, depth, token, update_progress, store=None,
+                           transpositions=False, metrics=None):
+    metrics = metrics or JobMetrics()
+    status, lock = {}, threading.Lock()
+    def report(player, message):
+        with lock:
+            status[player] = message
+            update_progress(" | ".join(f"Player {p}: {m}" for p, m in sorted(status.items())))
+    with metrics.phase('ingest'), ThreadPoolExecutor(max_workers=2) as executor:
+        p1_future = executor.submit(get_player_tree, p1, p1_filters, depth, token, store, lambda m: report(1, m), metrics)
+        p2_future = executor.submit(get_player_tree, p2, p2_filters, depth, token, store, lambda m: report(2, m), metrics)
+        p1_tree, p2_tree = p1_future.result(), p2_future.result()
+    failed = [player for player, tree in ((p1, p1_tree), (p2, p2_tree)) if tree is None]
+    if failed: raise AnalysisError(f"Could not download games for {' and '.join(failed)} from Lichess.")
+    metrics.add('tree_nodes', count_nodes(p1_tree) + count_nodes(p2_tree))
     update_progress("Intersecting Player Trees...")
-    return intersect_trees(p1_tree, p2_tree, threshold)
+    with metrics.phase('intersect'):
+        if transpositions: tree = intersect_dags(build_position_dag(p1_tree), build_position_dag(p2_tree), threshold)
+        else: tree = intersect_trees(p1_tree, p2_tree, threshold)
+    metrics.add('intersected_nodes', count_nodes(tree))
+    return tree
+
+def get_player_tree(player, filters, depth, token, store=None, report=None, metrics=None):
+    if report: report("Starting Stream...")
+    tree, newest, records = store.load(player, filters, depth) if store else (None, 0, None)
+    if tree:
+        update = stream_into_tree(tree, player, dict(filters, since=newest + 1000), depth, token, report, metrics, records)
+        if update is None: return tree
+        newest = max(newest, update[0])
+    else:
+        tree, records = ChessNode(START_FEN, 'root', 'root'), [] if store else None
+        update = stream_into_tree(tree, player, filters, depth, token, report, metrics, records)
+        if update is None: return None
+        newest = update[0]
+    if store:
+        if filters.get('max'): trim_oldest_games(records, int(filters['max']))
+        store.save(player, filters, depth, tree, newest, records)
+    if report: report("Tree Built.")
+    return tree
 
-def get_game_stream(player, filters, token):
+def stream_into_tree(tree, player, params, depth, token, report=None, metrics=None, records=None):
+    stream = get_game_stream(player, params, token)
+    if stream is None: return None
+    games = resume_game_stream(stream, player, params, token, metrics=metrics)
+    return update_tree_from_games(tree, games, depth, report, metrics, records)
+
+def game_record(played, leaf, result, w_elo, b_elo, tc, clocks):
+    return (played, leaf, result, w_elo, b_elo, tc, array('f', (NAN if clock is None else clock for clock in clocks)))
+
+def trim_oldest_games(records, limit):
+    overflow = len(records) - limit
+    if overflow <= 0: return
+    records.sort(key=lambda record: record[0])
+    dropped = {}
+    for _, head, result, w_elo, b_elo, tc, clocks in records[:overflow]:
+        path = []
+        while head.parent is not None: path.append(head); head = head.parent
+        w_clock = b_clock = float(parse_time_control(tc)[0])
+        for ply, (node, clock) in enumerate(zip(reversed(path), clocks), 1):
+            if ply % 2: w_clock = clock
+            else: b_clock = clock
+            node.remove_result(result)
+            dropped.setdefault(node, Occurrences()).append(w_elo, b_elo, w_clock, b_clock, tc)
+    for node, rows in dropped.items():
+        node.occ.remove(rows)
+        if not len(node.occ): node.parent.children.pop(node.san, None)
+    del records[:overflow]
+
+lichess_session = requests.Session()
+lichess_session.mount('https://', HTTPAdapter(pool_maxsize=8))
+lichess_session.mount('http://', HTTPAdapter(pool_maxsize=8))
+
+def retry_after(res):
+    try: return min(float(res.headers.get('Retry-After', LICHESS_RATE_LIMIT_WAIT)), LICHESS_RATE_LIMIT_WAIT * 5)
+    except ValueError: return LICHESS_RATE_LIMIT_WAIT
+
+def get_game_stream(player, filters, token, retries=LICHESS_RETRIES):
     headers = { 'Content-Type': 'application/x-chess-pgn' }
     if token: headers['Authorization'] = f'Bearer {token}'
-    url = f"https://lichess.org/api/games/user/{player}"
-    try:
-        res = requests.get(url, params=filters, headers=headers, stream=True, timeout=1800)
-        res.raise_for_status()
-        return res
-    except requests.RequestException: return None
-
-def pgn_generator(res):
-    buffer = ""
-    for chunk in res.iter_content(chunk_size=1024):
-        buffer += chunk.decode('utf-8')
-        while "\n\n\n" in buffer:
-            pgn_string, buffer = buffer.split("\n\n\n", 1)
-            if pgn_string.strip(): yield pgn_string.strip()
+    url = f"{LICHESS_URL}/api/games/user/{player}"
+    for attempt in range(retries + 1):
+        try:
+            res = lichess_session.get(url, params=filters, headers=headers, stream=True, timeout=LICHESS_TIMEOUT)
+            if res.status_code == 429:
+                wait = retry_after(res)
+                res.close()
+            elif res.status_code >= 500:
+                wait = min(2 ** attempt, LICHESS_BACKOFF_MAX)
+                res.close()
+            else:
+                res.raise_for_status()
+                return res
+        except requests.HTTPError: return None
+        except requests.RequestException: wait = min(2 ** attempt, LICHESS_BACKOFF_MAX)
+        if attempt < retries: time.sleep(wait)
+    return None
+
+def resume_game_stream(stream, player, filters, token, retries=LICHESS_RETRIES, metrics=None):
+    last, seen, sent = None, set(), 0
+    for attempt in range(retries + 1):
+        try:
+            for pgn in pgn_generator(stream):
+                headers = dict(HEADER_RE.findall(pgn))
+                played = game_timestamp(headers)
+                if played == last and headers.get('Site') in seen: continue
+                if played != last: last, seen = played, set()
+                seen.add(headers.get('Site'))
+                sent += 1
+                yield pgn
+            return
+        except requests.RequestException as error:
+            stream.close()
+            if attempt == retries: raise
+            if metrics: metrics.add('stream_resumes')
+            params = dict(filters)
+            if last: params['until'] = last + 999
+            if 'max' in filters: params['max'] = int(filters['max']) - sent + len(seen)
+            time.sleep(min(2 ** attempt, LICHESS_BACKOFF_MAX))
+            stream = get_game_stream(player, params, token)
+            if stream is None: raise requests.ConnectionError(f"Could not resume the game stream for {player}.") from error
+
+def pgn_generator(res, chunk_size=PGN_CHUNK_SIZE):
+    return split_pgn_games(res.iter_content(chunk_size=chunk_size))
+
+def pgn_file_generator(path, chunk_size=PGN_CHUNK_SIZE, use_mmap=False):
+    with open(path, 'rb') as fp:
+        if not use_mmap:
+            yield from split_pgn_games(iter(lambda: fp.read(chunk_size), b''))
+        elif os.fstat(fp.fileno()).st_size:
+            with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                yield from split_pgn_games(mm[i:i+chunk_size] for i in range(0, len(mm), chunk_size))
+
+def split_pgn_games(chunks):
+    buffer, start, search = bytearray(), 0, 0
+    for chunk in chunks:
+        buffer += chunk
+        games = []
+        with memoryview(buffer) as view:
+            while (end := buffer.find(GAME_SEPARATOR, search)) != -1:
+                games.append(str(view[start:end], 'utf-8', 'replace').strip())
+                start = search = end + len(GAME_SEPARATOR)
+        search = max(start, len(buffer) - len(GAME_SEPARATOR) + 1)
+        if start > len(buffer) // 2:
+            del buffer[:start]
+            search, start = search - start, 0
+        yield from (game for game in games if game)
+    game = str(buffer[start:], 'utf-8', 'replace').strip()
+    if game: yield game
 
 def get_tree_from_stream(stream, depth):
-    start_fen = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
-    root = ChessNode(start_fen, 'root', 'root')
-    for pgn in pgn_generator(stream): add_game_to_tree(root, pgn, depth)
+    root = ChessNode(START_FEN, 'root', 'root')
+    update_tree_from_stream(root, stream, depth)
     return root
 
-def add_game_to_tree(tree, pgn, depth):
-    if not pgn: return
+def update_tree_from_stream(tree, stream, depth, report=None, metrics=None):
+    return update_tree_from_games(tree, pgn_generator(stream), depth, report, metrics)
+
+def update_tree_from_games(tree, games, depth, report=None, metrics=None, records=None):
+    newest = i = parse_time = 0
+    if report: report("Building Tree...")
+    start = time.perf_counter()
+    for i, pgn in enumerate(games, 1):
+        parse_start = time.perf_counter()
+        newest = max(newest, add_pgn_to_tree(tree, pgn, depth, records))
+        parse_time += time.perf_counter() - parse_start
+        if report and i % PROGRESS_INTERVAL == 0: report(f"Building Tree... ({i} games)")
+    if metrics:
+        metrics.add('games', i)
+        metrics.add('parse_seconds', parse_time)
+        metrics.add('download_seconds', time.perf_counter() - start - parse_time)
+    return newest, i
+
+def game_timestamp(headers):
+    try:
+        played = datetime.strptime(f"{headers['UTCDate']} {headers['UTCTime']}", "%Y.%m.%d %H:%M:%S")
+        return int(played.replace(tzinfo=timezone.utc).timestamp() * 1000)
+    except (KeyError, ValueError): return 0
+
+def add_game_to_tree(tree, pgn, depth, records=None):
+    if not pgn: return 0
     game = chess.pgn.read_game(io.StringIO(pgn))
     result = game.headers.get("Result")
     w_elo = game.headers.get(f"WhiteElo")
@@ -183,16 +398,76 @@ def add_game_to_tree(tree, pgn, depth):
     tc = game.headers.get('TimeControl')
     base = tc.split('/')[-1].split(':')[0].split('+')[0]
     b_clock, w_clock = float(base), float(base)
-    head = tree
+    head, clocks = tree, []
     for node in game.mainline():
         board = node.board()
         fen, san, uci, ply = board.fen(), node.san(), node.move.uci(), node.ply()
         if ply > depth: break
         if ply % 2: w_clock = node.clock()
         else: b_clock = node.clock()
-        if san not in head.children: head.add_child(ChessNode(fen, san, uci))
+        clocks.append(node.clock())
+        if san not in head.children: head.add_child(ChessNode(fen, san, uci, head))
         head.children[san].add_instance(result, w_elo, b_elo, w_clock, b_clock, tc)
         head = head.children[san]
+    played = game_timestamp(game.headers)
+    if records is not None: records.append(game_record(played, head, result, w_elo, b_elo, tc, clocks))
+    return played
+
+def read_pgn_moves(pgn, depth):
+    header_text, _, movetext = pgn.partition("\n\n")
+    headers = dict(HEADER_RE.findall(header_text))
+    moves, variation = [], 0
+    for match in MOVETEXT_RE.finditer(movetext):
+        token = match.group(0)
+        if token == "(": variation += 1
+        elif token == ")": variation -= 1
+        elif variation: continue
+        elif match.group(1) is not None:
+            clock = CLOCK_RE.search(match.group(1))
+            if clock and moves and moves[-1][1] is None:
+                h, m, sec = clock.groups()
+                moves[-1][1] = int(h) * 3600 + int(m) * 60 + float(sec)
+        elif token[0] in ";$": continue
+        elif token in RESULTS: break
+        else:
+            san = token.lstrip("0123456789.").rstrip("!?")
+            if not san: continue
+            if len(moves) == depth: break
+            moves.append([san, None])
+    return headers, moves
+
+def add_pgn_to_tree(tree, pgn, depth, records=None):
+    if not pgn: return 0
+    headers, moves = read_pgn_moves(pgn, depth)
+    if "FEN" in headers: return add_game_to_tree(tree, pgn, depth, records)
+    result = headers.get("Result")
+    w_elo = headers.get("WhiteElo")
+    b_elo = headers.get("BlackElo")
+    tc = headers.get("TimeControl")
+    base = tc.split('/')[-1].split(':')[0].split('+')[0]
+    b_clock, w_clock = float(base), float(base)
+    head, board = tree, None
+    for ply, (san, clock) in enumerate(moves, 1):
+        if ply % 2: w_clock = clock
+        else: b_clock = clock
+        child = head.children.get(san)
+        if child: board = None
+        else:
+            if board is None: board = chess.Board(head.fen)
+            try: move = board.parse_san(san)
+            except ValueError: break
+            san = board.san(move)
+            child = head.children.get(san)
+            if child: board = None
+            else:
+                board.push(move)
+                child = ChessNode(None, san, move.uci(), head)
+                head.add_child(child)
+        child.add_instance(result, w_elo, b_elo, w_clock, b_clock, tc)
+        head = child
+    played = game_timestamp(headers)
+    if records is not None: records.append(game_record(played, head, result, w_elo, b_elo, tc, [c for _, c in moves]))
+    return played
 
 def print_tree(tree, depth=0):
     if not tree: return
@@ -204,8 +479,7 @@ def print_tree(tree, depth=0):
         print_tree(child, depth+1)
 
 def intersect_trees(p1_tree, p2_tree, threshold):
-    start_fen = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
-    root = SharedNode(start_fen, 'root', 'root')
+    root = SharedNode(START_FEN, 'root', 'root')
     root.counts['p1'], root.counts['p2'] = p1_tree.get_count(), p2_tree.get_count()
     def intersect_recursive(p1_node, p2_node, head=root, ply=0):
         for child1 in p1_node.children.values():
@@ -222,104 +496,368 @@ def intersect_trees(p1_tree, p2_tree, threshold):
     intersect_recursive(p1_tree, p2_tree)
     return root
 
-def add_static_features(tree, stockfish_path):
-    engine = chess.engine.SimpleEngine.popen_uci(stockfish_path)
-    def add_recursively(node):
-        board = chess.Board(node.fen)
-        dyn_info = engine.analyse(board, chess.engine.Limit(time=0.2))
-        sta_info = engine.analyse(board, chess.engine.Limit(depth=0))
-        node.features['engine_eval_cp'] = dyn_info['score'].white().score(mate_score=10000)
-        node.features['static_eval_cp'] = sta_info['score'].white().score(mate_score=10000)
-        node.features['ply_number'] = board.ply()
-        node.features['turn'] = 'w' if board.turn == chess.WHITE else 'b'
-        node.features['white_castle_kingside'] = bool(board.castling_rights & chess.BB_H1)
-        node.features['white_castle_queenside'] = bool(board.castling_rights & chess.BB_A1)
-        node.features['black_castle_kingside'] = bool(board.castling_rights & chess.BB_H8)
-        node.features['black_castle_queenside'] = bool(board.castling_rights & chess.BB_A8)
-        node.features['halfmove_clock'] = board.halfmove_clock
-        node.features['white_material'], node.features['black_material'] = material(board)
-        node.features['isolated_pawns_w'] = isolated_pawns(board, chess.WHITE);
-        node.features['doubled_pawns_w'] = doubled_pawns(board, chess.WHITE);
-        node.features['passed_pawns_w'] = passed_pawns(board, chess.WHITE);
-        node.features['isolated_pawns_b'] = isolated_pawns(board, chess.BLACK);
-        node.features['doubled_pawns_b'] = doubled_pawns(board, chess.BLACK);
-        node.features['passed_pawns_b'] = passed_pawns(board, chess.BLACK);
-        node.features['king_safety_w'] = king_safety(board, chess.WHITE);
-        node.features['king_safety_b'] = king_safety(board, chess.BLACK);
-        node.features['mobility'] = mobility(board);
-        for child in node.children.values():
-            add_recursively(child)
-    add_recursively(tree)
-    engine.quit()
-
-def get_prediction(features_dict, onnx_session):
-    feature_order = [
-        'white_rating', 'black_rating', 'white_clock', 'black_clock', 'ply_number',
-        'is_white_turn', 'engine_eval_cp', 'white_material', 'black_material',
-        'rating_diff', 'material_diff', 'clock_diff', 'base_time_sec', 'increment_sec',
-        'static_eval_cp', 'eval_discrepancy', 'mobility', 'isolated_pawns_w',
-        'isolated_pawns_b', 'doubled_pawns_w', 'doubled_pawns_b', 'passed_pawns_w',
-        'passed_pawns_b', 'king_safety_w', 'king_safety_b',
-        'white_castle_kingside', 'white_castle_queenside', 'black_castle_kingside',
-        'black_castle_queenside', 'halfmove_clock'
-    ]
-    input_array = [features_dict.get(feature, 0) for feature in feature_order]
-    input_np = np.array(input_array, dtype=np.float32).reshape(1, -1)
+def build_position_dag(tree):
+    positions, board = {}, chess.Board(tree.fen)
+    def merge(node, ply=0):
+        key = (chess.polyglot.zobrist_hash(board), ply)
+        if key not in positions: positions[key] = PositionNode(key)
+        position = positions[key]
+        position.sources.append(node)
+        for san, child in node.children.items():
+            board.push(chess.Move.from_uci(child.uci))
+            child_position = merge(child, ply+1)
+            board.pop()
+            edge = position.moves.setdefault(san, [child.uci, child_position, 0])
+            edge[2] += child.get_count()
+        return position
+    return merge(tree)
+
+def intersect_dags(p1_dag, p2_dag, threshold):
+    root = SharedNode(START_FEN, 'root', 'root')
+    root.counts['p1'], root.counts['p2'] = p1_dag.get_count(), p2_dag.get_count()
+    root.position = p1_dag.key
+    features = {}
+    def intersect_recursive(p1_pos, p2_pos, head=root, ply=0):
+        for san, (uci, child1, count1) in p1_pos.moves.items():
+            if san not in p2_pos.moves: continue
+            _, child2, count2 = p2_pos.moves[san]
+            w_rate = count1 / head.get_count('p1')
+            b_rate = count2 / head.get_count('p2')
+            if (w_rate < threshold and ply % 2 == 0) or (b_rate < threshold and ply % 2 == 1):
+                continue
+            child = SharedNode(child1.fen, san, uci)
+            head.children[san] = child
+            child.p1_res, child.p2_res = child1.res, child2.res
+            child.p1_occ, child.p2_occ = child1.occ, child2.occ
+            child.counts['p1'], child.counts['p2'] = child1.get_count(), child2.get_count()
+            child.rates['w'], child.rates['b'] = w_rate, b_rate
+            child.position = child1.key
+            child.features = features.setdefault(child1.key, {})
+            intersect_recursive(child1, child2, child, ply+1)
+    intersect_recursive(p1_dag, p2_dag)
+    return root
+
+class EnginePool:
+    def __init__(self, stockfish_path, size=ENGINE_POOL_SIZE, threads=ENGINE_THREADS, hash_mb=ENGINE_HASH_MB):
+        self.stockfish_path = stockfish_path
+        self.options = {"Threads": threads, "Hash": hash_mb}
+        self.size = max(1, size)
+        self.idle = queue.Queue()
+        self.executor = ThreadPoolExecutor(max_workers=self.size)
+        for _ in range(self.size): self.idle.put(self.start_engine())
+
+    def start_engine(self):
+        engine = chess.engine.SimpleEngine.popen_uci(self.stockfish_path)
+        engine.configure(self.options)
+        return engine
+
+    def run(self, fn, *args):
+        engine = self.idle.get()
+        try: return fn(engine, *args)
+        except chess.engine.EngineTerminatedError:
+            engine = self.start_engine()
+            raise
+        finally: self.idle.put(engine)
+
+    def map(self, fn, items):
+        return self.executor.map(lambda item: self.run(fn, item), items)
+
+    def close(self):
+        self.executor.shutdown()
+        for _ in range(self.size): self.idle.get().quit()
+
+    def __enter__(self): return self
+
+    def __exit__(self, *exc): self.close()
+
+@lru_cache(maxsize=None)
+def get_engine_pool(stockfish_path=STOCKFISH_EXECUTABLE_PATH, size=ENGINE_POOL_SIZE):
+    return EnginePool(stockfish_path, size)
+
+@lru_cache(maxsize=None)
+def get_onnx_session(model_path=ONNX_MODEL_PATH, intra_op_threads=ONNX_INTRA_OP_THREADS):
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    options.intra_op_num_threads = intra_op_threads
+    options.inter_op_num_threads = 1
+    return ort.InferenceSession(model_path, sess_options=options, providers=['CPUExecutionProvider'])
+
+def iter_nodes(tree):
+    yield tree
+    for child in tree.children.values(): yield from iter_nodes(child)
+
+def count_nodes(tree): return sum(1 for _ in iter_nodes(tree))
+
+def allocate_engine_time(tree, budget=ENGINE_TIME_BUDGET, workers=1):
+    weights = {}
+    def weigh(node, ply=0):
+        weights[id(node)] = math.sqrt(1 + node.counts['p1'] + node.counts['p2']) * ENGINE_PLY_DECAY ** ply
+        for child in node.children.values(): weigh(child, ply+1)
+    weigh(tree)
+    mean = sum(weights.values()) / len(weights)
+    times = {node_id: min(ENGINE_MAX_TIME, max(ENGINE_MIN_TIME, ENGINE_NODE_TIME * w / mean))
+             for node_id, w in weights.items()}
+    capacity = budget * workers
+    if sum(times.values()) <= capacity: return times
+    floor, fixed = min(ENGINE_MIN_TIME, capacity / len(times)), {}
+    while times:
+        scale = (capacity - floor * len(fixed)) / sum(times.values())
+        low = [node_id for node_id, seconds in times.items() if seconds * scale < floor]
+        if not low: return {**fixed, **{node_id: seconds * scale for node_id, seconds in times.items()}}
+        for node_id in low: del times[node_id]
+        fixed.update(dict.fromkeys(low, floor))
+    return fixed
+
+def get_terminal_features(board):
+    outcome = board.outcome()
+    if outcome is None: return None
+    score = 0 if outcome.winner is None else (10000 if outcome.winner == chess.WHITE else -10000)
+    return {'engine_eval_cp': score, 'static_eval_cp': score, 'engine_time': float('inf')}
+
+def get_position_features(engine, fen, seconds):
+    board = chess.Board(fen)
+    dyn_info = engine.analyse(board, chess.engine.Limit(time=seconds))
+    sta_info = engine.analyse(board, chess.engine.Limit(depth=0))
+    return {
+        'engine_eval_cp': dyn_info['score'].white().score(mate_score=10000),
+        'static_eval_cp': sta_info['score'].white().score(mate_score=10000),
+        'engine_time': seconds
+    }
+
+def plan_engine_tasks(tree, pool_size=ENGINE_POOL_SIZE, cache=None, budget=ENGINE_TIME_BUDGET, batch_size=0):
+    nodes = list(iter_nodes(tree))
+    keys = [position_key(node.fen) for node in nodes]
+    position_features = cache.get_many(keys) if cache else {}
+    terminal = {}
+    for key, node in zip(keys, nodes):
+        if key in position_features or key in terminal: continue
+        features = get_terminal_features(chess.Board(node.fen))
+        if features: terminal[key] = features
+    def schedule(workers):
+        node_times, tasks = allocate_engine_time(tree, budget, workers), {}
+        for key, node in zip(keys, nodes):
+            cached = position_features.get(key)
+            if key in terminal or (cached and cached.get('engine_time', 0) >= node_times[id(node)]): continue
+            tasks[key] = (node.fen, max(node_times[id(node)], tasks.get(key, ('', 0))[1]))
+        return tasks
+    workers = max(1, min(pool_size, len(nodes)))
+    tasks = schedule(workers)
+    if batch_size and len(tasks) > batch_size:
+        fanned = schedule(workers * math.ceil(len(tasks) / batch_size))
+        if len(fanned) > batch_size: tasks = fanned
+    position_features.update(terminal)
+    return tasks, terminal, position_features
+
+def run_engine_tasks(tasks, stockfish_path, pool_size=ENGINE_POOL_SIZE, pool=None):
+    if not tasks: return {}
+    if pool: return dict(zip(tasks, pool.map(lambda engine, task: get_position_features(engine, *task), tasks.values())))
+    with EnginePool(stockfish_path, min(pool_size, len(tasks))) as pool:
+        return dict(zip(tasks, pool.map(lambda engine, task: get_position_features(engine, *task), tasks.values())))
+
+def apply_position_features(tree, position_features):
+    for node in iter_nodes(tree): node.features.update(position_features[position_key(node.fen)])
+
+OCC_COLUMNS = [FEATURE_ORDER.index(feature) for feature in (
+    'base_time_sec', 'increment_sec', 'white_rating', 'black_rating',
+    'white_clock', 'black_clock', 'clock_diff'
+)]
+ENGINE_COLUMNS = [FEATURE_ORDER.index(feature) for feature in ('engine_eval_cp', 'static_eval_cp', 'eval_discrepancy')]
+PREDICTION_BATCH_SIZE = int(os.getenv('PREDICTION_BATCH_SIZE', 8192))
+
+def get_base_rows(nodes):
+    rows = extract_features([chess.Board(node.fen) for node in nodes])
+    evals = [(node.features["engine_eval_cp"], node.features["static_eval_cp"]) for node in nodes]
+    rows[:, ENGINE_COLUMNS] = [(engine, static, engine - static) for engine, static in evals]
+    return rows
+
+def get_feature_rows(base_row, occ):
+    rows = np.tile(base_row, (len(occ), 1))
+    if len(occ):
+        c = occ.columns()
+        w_clock, b_clock = np.trunc(c['w_clock']), np.trunc(c['b_clock'])
+        rows[:, OCC_COLUMNS] = np.column_stack((
+            c['base'], c['inc'], c['w_elo'], c['b_elo'], w_clock, b_clock, w_clock - b_clock
+        ))
+    return rows
+
+def predict_rows(rows, onnx_session, batch_size=PREDICTION_BATCH_SIZE):
     input_name = onnx_session.get_inputs()[0].name
-    prediction = onnx_session.run(None, {input_name: input_np})
-    probs = prediction[1][0]
-    b_wins, w_wins, draws = probs
+    probs = np.empty((len(rows), 3), dtype=np.float32)
+    for start in range(0, len(rows), batch_size):
+        chunk = rows[start:start+batch_size]
+        probs[start:start+len(chunk)] = onnx_session.run(None, {input_name: chunk})[1]
+    return probs
+
+def average_probs(probs):
+    if not len(probs): return {"w_wins": 0, "draws": 0, "b_wins": 0}
+    b_wins, w_wins, draws = probs.astype(np.float64).mean(axis=0)
     return {"w_wins": float(w_wins), "draws": float(draws), "b_wins": float(b_wins)}
 
-def get_player_prediction(f, occ, onnx_session):
-    white_rates, draw_rates, black_rates = [], [], []
-    f["material_diff"] = f["white_material"] - f["black_material"]
-    f["eval_discrepancy"] = f["engine_eval_cp"] - f["static_eval_cp"]
-    f["is_white_turn"] = f["turn"] == "w"
-    for o in occ:
-        simple_tc = o["tc"].split('/')[-1].split(':')[0].split('+')
-        base = int(simple_tc[0])
-        inc = int(simple_tc[-1]) if len(simple_tc) > 1 else 0
-        f['base_time_sec'] = base
-        f['increment_sec'] = inc
-        f['white_rating'] = int(o['w_elo'])
-        f['black_rating'] = int(o['b_elo'])
-        f['white_clock'] = int(o['w_clock'])
-        f['black_clock'] = int(o['b_clock'])
-        f['clock_diff'] = int(o['w_clock']) - int(o['b_clock'])
-        probs = get_prediction(f, onnx_session)
-        white_rates.append(probs["w_wins"])
-        draw_rates.append(probs["draws"])
-        black_rates.append(probs["b_wins"])
-    w_wins = sum(white_rates) / len(white_rates) if len(white_rates) else 0
-    draws = sum(draw_rates) / len(draw_rates) if len(draw_rates) else 0
-    b_wins = sum(black_rates) / len(black_rates) if len(black_rates) else 0
-    return {"w_wins": w_wins, "draws": draws, "b_wins": b_wins}
-
-def add_predictions(tree, onnx_session):
-    node_data = {
-        "fen": tree.fen, "san": tree.san, "uci": tree.uci,
-        "eval": tree.features["engine_eval_cp"],
-        "rates": tree.rates, "counts": tree.counts,
-        "p1_res": tree.p1_res, "p2_res": tree.p2_res,
-        "p1_exp": get_player_prediction(tree.features, tree.p1_occ, onnx_session),
-        "p2_exp": get_player_prediction(tree.features, tree.p2_occ, onnx_session),
-        "children": [add_predictions(child, onnx_session) for child in tree.children.values()]
-    }
-    return node_data
+def prediction_key(node):
+    return id(node) if node.position is None else node.position
 
-def get_final_json_tree(p1, p2, p1_filters, p2_filters, threshold, depth, token=None):
-    job = get_current_job()
+def add_predictions(tree, onnx_session, batch_size=PREDICTION_BATCH_SIZE, metrics=None):
+    metrics = metrics or JobMetrics()
+    keys = {}
+    for node in iter_nodes(tree): keys.setdefault(prediction_key(node), node)
+    blocks = []
+    for base_row, node in zip(get_base_rows(list(keys.values())), keys.values()):
+        blocks.append(get_feature_rows(base_row, node.p1_occ))
+        blocks.append(get_feature_rows(base_row, node.p2_occ))
+    rows = np.concatenate(blocks)
+    with metrics.phase('inference'): probs = predict_rows(rows, onnx_session, batch_size)
+    metrics.add('inference_rows', len(rows))
+    offsets = np.cumsum([0] + [len(block) for block in blocks])
+    exps = [average_probs(probs[offsets[i]:offsets[i+1]]) for i in range(len(blocks))]
+    node_exps = {key: (exps[2*i], exps[2*i+1]) for i, key in enumerate(keys)}
+    def build_json(node):
+        p1_exp, p2_exp = node_exps[prediction_key(node)]
+        return {
+            "fen": node.fen, "san": node.san, "uci": node.uci,
+            "eval": node.features["engine_eval_cp"],
+            "rates": node.rates, "counts": node.counts,
+            "p1_res": node.p1_res, "p2_res": node.p2_res,
+            "p1_exp": p1_exp, "p2_exp": p2_exp,
+            "children": [build_json(child) for child in node.children.values()]
+        }
+    return build_json(tree)
+
+def complete_analysis(tree, analysed, position_features, onnx_session, cache=None, metrics=None):
+    if cache: cache.set_many(analysed)
+    position_features.update(analysed)
+    apply_position_features(tree, position_features)
+    return add_predictions(tree, onnx_session, metrics=metrics)
+
+def run_analysis(p1, p2, p1_filters, p2_filters, threshold, depth, onnx_session, token=None, transpositions=False,
+                 update_progress=print, metrics=None, store=None, cache=None, pool=None,
+                 stockfish_path=STOCKFISH_EXECUTABLE_PATH, budget=ENGINE_TIME_BUDGET, fan_out=None):
+    metrics = metrics or JobMetrics()
+    tree = build_intersected_tree(p1, p2, p1_filters, p2_filters, threshold, depth, token, update_progress,
+                                  store, transpositions, metrics)
+    update_progress("Analyzing Positions...")
+    with metrics.phase('engine'):
+        tasks, analysed, position_features = plan_engine_tasks(tree, pool.size if pool else ENGINE_POOL_SIZE, cache, budget,
+                                                               ENGINE_BATCH_SIZE if fan_out else 0)
+    metrics.add('engine_positions', len(tasks))
+    if fan_out and fan_out(tree, tasks, analysed, position_features): return None
+    with metrics.phase('engine'): analysed.update(run_engine_tasks(tasks, stockfish_path, pool=pool))
+    update_progress("Predicting Scores...")
+    return complete_analysis(tree, analysed, position_features, onnx_session, cache, metrics)
+
+def analysis_state_key(job_id): return f"analysis:state:{job_id}"
+
+def engine_progress_key(job_id): return f"analysis:engine:{job_id}"
+
+def job_progress(job):
     def update_progress(message):
         job.meta['progress'] = message
         job.save_meta()
-    onnx_session = ort.InferenceSession(ONNX_MODEL_PATH)
-    tree = build_intersected_tree(p1, p2, p1_filters, p2_filters, threshold, depth, token, update_progress)
-    update_progress("Analyzing Positions...")
-    add_static_features(tree, STOCKFISH_EXECUTABLE_PATH)
-    update_progress("Predicting Scores...")
-    return add_predictions(tree, onnx_session)
+        publish_progress(job.connection, job.id, "running", progress=message)
+    return update_progress
+
+def publish_result(job, result, metrics, started):
+    with metrics.phase('store'): result_bytes = get_result_store(job.connection).put(job.id, result)
+    metrics.add('result_bytes', result_bytes)
+    metrics.add('job_seconds', time.time() - started)
+    job.meta['metrics'] = metrics.summary()
+    job.save_meta()
+    record_job(job.connection, job.meta['metrics'], "finished")
+    publish_progress(job.connection, job.id, "finished")
+    return result_bytes
+
+def failure_message(error):
+    if isinstance(error, AnalysisError): return str(error)
+    if isinstance(error, requests.RequestException): return LICHESS_FAILED_MESSAGE
+    return ANALYSIS_FAILED_MESSAGE
+
+def fail_analysis(job, error, metrics, started):
+    metrics.add('job_seconds', time.time() - started)
+    record_job(job.connection, metrics.summary(), "failed")
+    publish_progress(job.connection, job.id, "failed", error=failure_message(error))
+
+def fan_out_engine_tasks(job, tree, tasks, analysed, position_features, metrics, started):
+    items = list(tasks.items())
+    batches = [dict(items[i:i+ENGINE_BATCH_SIZE]) for i in range(0, len(items), ENGINE_BATCH_SIZE)]
+    state = {
+        "tree": tree, "tasks": tasks, "analysed": analysed, "position_features": position_features,
+        "metrics": metrics.values, "started": started, "fanned_out": time.time()
+    }
+    job.connection.set(analysis_state_key(job.id), zlib.compress(pickle.dumps(state, pickle.HIGHEST_PROTOCOL)),
+                       ex=ANALYSIS_STATE_TTL)
+    job.connection.set(engine_progress_key(job.id), 0, ex=ANALYSIS_STATE_TTL)
+    aggregate_id = str(uuid.uuid4())
+    job.meta['aggregate_job'] = aggregate_id
+    job.meta['engine_positions'] = len(tasks)
+    job_progress(job)(f"Analyzing Positions... (0/{len(tasks)} positions)")
+    queue = Queue(job.origin, connection=job.connection)
+    batch_jobs = queue.enqueue_many([
+        Queue.prepare_data(analyse_position_batch, (job.id, batch, len(tasks)), timeout=job.timeout,
+                           result_ttl=ANALYSIS_STATE_TTL)
+        for batch in batches
+    ])
+    return queue.enqueue(aggregate_engine_batches, job.id, [batch.id for batch in batch_jobs], job_id=aggregate_id,
+                         depends_on=Dependency(jobs=batch_jobs, allow_failure=True),
+                         job_timeout=job.timeout, result_ttl=job.result_ttl)
 
+def analyse_position_batch(parent_id, tasks, total):
+    connection = get_current_job().connection
+    pool = get_engine_pool() if WORKER_MODE == 'warm' else None
+    analysed = run_engine_tasks(tasks, STOCKFISH_EXECUTABLE_PATH, pool=pool)
+    done = connection.incrby(engine_progress_key(parent_id), len(tasks))
+    publish_progress(connection, parent_id, "running", progress=f"Analyzing Positions... ({done}/{total} positions)")
+    return analysed
+
+def aggregate_engine_batches(parent_id, batch_ids):
+    connection = get_current_job().connection
+    parent = Job.fetch(parent_id, connection=connection)
+    blob = connection.get(analysis_state_key(parent_id))
+    if blob is None: raise RuntimeError("Analysis state has expired.")
+    state = pickle.loads(zlib.decompress(blob))
+    metrics = JobMetrics()
+    metrics.values.update(state["metrics"])
+    try:
+        analysed = state["analysed"]
+        for batch in Job.fetch_many(batch_ids, connection=connection):
+            if batch and batch.is_finished: analysed.update(batch.return_value())
+        missing = {key: task for key, task in state["tasks"].items() if key not in analysed}
+        pool = get_engine_pool() if WORKER_MODE == 'warm' else None
+        analysed.update(run_engine_tasks(missing, STOCKFISH_EXECUTABLE_PATH, pool=pool))
+        metrics.add('engine_seconds', time.time() - state["fanned_out"])
+        connection.delete(engine_progress_key(parent_id))
+        job_progress(parent)("Predicting Scores...")
+        with metrics.phase('startup'): onnx_session = get_onnx_session()
+        cache = get_position_cache(connection=connection)
+        result = complete_analysis(state["tree"], analysed, state["position_features"], onnx_session, cache, metrics)
+        if cache: cache.close()
+        result_bytes = publish_result(parent, result, metrics, state["started"])
+    except Exception as e:
+        fail_analysis(parent, e, metrics, state["started"])
+        raise
+    finally: connection.delete(analysis_state_key(parent_id), engine_progress_key(parent_id))
+    return {"result_bytes": result_bytes}
+
+def get_final_json_tree(p1, p2, p1_filters, p2_filters, threshold, depth, token=None, transpositions=False):
+    job = get_current_job()
+    metrics, started = JobMetrics(), time.time()
+    def fan_out(tree, tasks, analysed, position_features):
+        if not ENGINE_BATCH_SIZE or len(tasks) <= ENGINE_BATCH_SIZE: return None
+        if cache: job.meta['position_cache'] = cache.stats()
+        return fan_out_engine_tasks(job, tree, tasks, analysed, position_features, metrics, started)
+    try:
+        with metrics.phase('startup'):
+            onnx_session = get_onnx_session()
+            pool = get_engine_pool() if WORKER_MODE == 'warm' else None
+        cache = get_position_cache(connection=job.connection)
+        result = run_analysis(p1, p2, p1_filters, p2_filters, threshold, depth, onnx_session, token, transpositions,
+                              job_progress(job), metrics, get_tree_store(), cache, pool, fan_out=fan_out)
+        if cache: cache.close()
+        if result is None: return {"aggregate_job": job.meta['aggregate_job']}
+        if cache: job.meta['position_cache'] = cache.stats()
+        result_bytes = publish_result(job, result, metrics, started)
+    except Exception as e:
+        fail_analysis(job, e, metrics, started)
+        raise
+    return {"result_bytes": result_bytes}
 
 if __name__ == '__main__':
     filters = {
@@ -340,6 +878,6 @@ if __name__ == '__main__':
     # tree = get_tree_from_stream(stream, 5)
     # print_tree(tree)
 
-    json_tree = get_final_json_tree(player1, player2, filters["p1"], filters["p2"], 0.15, 20)
+    json_tree = run_analysis(player1, player2, filters["p1"], filters["p2"], 0.15, 20, get_onnx_session())
     with open('tree.json', 'w') as fp:
         json.dump(json_tree, fp)
\ No newline at end of file
@@ -0,0 +1,105 @@
+import chess
+import numpy as np
+
+FEATURE_ORDER = [
+    'white_rating', 'black_rating', 'white_clock', 'black_clock', 'ply_number',
+    'is_white_turn', 'engine_eval_cp', 'white_material', 'black_material',
+    'rating_diff', 'material_diff', 'clock_diff', 'base_time_sec', 'increment_sec',
+    'static_eval_cp', 'eval_discrepancy', 'mobility', 'isolated_pawns_w',
+    'isolated_pawns_b', 'doubled_pawns_w', 'doubled_pawns_b', 'passed_pawns_w',
+    'passed_pawns_b', 'king_safety_w', 'king_safety_b',
+    'white_castle_kingside', 'white_castle_queenside', 'black_castle_kingside',
+    'black_castle_queenside', 'halfmove_clock'
+]
+BOARD_FEATURES = [
+    'white_material', 'black_material', 'isolated_pawns_w', 'doubled_pawns_w', 'passed_pawns_w',
+    'isolated_pawns_b', 'doubled_pawns_b', 'passed_pawns_b', 'king_safety_w', 'king_safety_b',
+    'mobility', 'white_castle_kingside', 'white_castle_queenside', 'black_castle_kingside',
+    'black_castle_queenside'
+]
+MATRIX_COLUMNS = [FEATURE_ORDER.index(feature) for feature in (
+    *BOARD_FEATURES, 'ply_number', 'is_white_turn', 'halfmove_clock', 'material_diff'
+)]
+
+def ranks_mask(ranks):
+    mask = 0
+    for r in ranks:
+        if 0 <= r < 8: mask |= chess.BB_RANKS[r]
+    return mask
+
+BB_ADJACENT_FILES = [(chess.BB_FILES[f-1] if f > 0 else 0) | (chess.BB_FILES[f+1] if f < 7 else 0) for f in range(8)]
+BB_NEAR_FILES = [chess.BB_FILES[f] | BB_ADJACENT_FILES[f] for f in range(8)]
+BB_PASSED_SPAN = {
+    chess.WHITE: [BB_NEAR_FILES[sq & 7] & ranks_mask(range((sq >> 3) + 1, 8)) for sq in chess.SQUARES],
+    chess.BLACK: [BB_NEAR_FILES[sq & 7] & ranks_mask(range(sq >> 3)) for sq in chess.SQUARES],
+}
+BB_KING_SHIELD = {
+    chess.WHITE: [BB_NEAR_FILES[sq & 7] & ranks_mask(((sq >> 3) + 1, (sq >> 3) + 2)) for sq in chess.SQUARES],
+    chess.BLACK: [BB_NEAR_FILES[sq & 7] & ranks_mask(((sq >> 3) - 1, (sq >> 3) - 2)) for sq in chess.SQUARES],
+}
+BB_KING_ZONE = [chess.BB_KING_ATTACKS[sq] | chess.BB_SQUARES[sq] for sq in chess.SQUARES]
+PIECE_VALUES = ((chess.PAWN, 1), (chess.KNIGHT, 3), (chess.BISHOP, 3), (chess.ROOK, 5), (chess.QUEEN, 9))
+
+def pawn_structure(pawns, opp_pawns, color):
+    doubled = isolated = passed = 0
+    for f in range(8):
+        on_file = (pawns & chess.BB_FILES[f]).bit_count()
+        if not on_file: continue
+        doubled += on_file - 1
+        if not pawns & BB_ADJACENT_FILES[f]: isolated += on_file
+    spans = BB_PASSED_SPAN[color]
+    for sq in chess.scan_forward(pawns):
+        if not opp_pawns & spans[sq]: passed += 1
+    return isolated, doubled, passed
+
+def attacks_by(board, color):
+    pawns = board.pawns & board.occupied_co[color]
+    if color: attacks = ((pawns & ~chess.BB_FILE_A) << 7 | (pawns & ~chess.BB_FILE_H) << 9) & chess.BB_ALL
+    else: attacks = (pawns & ~chess.BB_FILE_A) >> 9 | (pawns & ~chess.BB_FILE_H) >> 7
+    for sq in chess.scan_forward(board.occupied_co[color] & ~board.pawns): attacks |= board.attacks_mask(sq)
+    return attacks
+
+def king_safety(board, color, pawns, opp_pawns, opp_attacks):
+    ksq = board.king(color)
+    shield_score = min((pawns & BB_KING_SHIELD[color][ksq]).bit_count(), 3)
+    kfile = chess.BB_FILES[ksq & 7]
+    if pawns & kfile: file_score = 2
+    elif opp_pawns & kfile: file_score = 1
+    else: file_score = 0
+    attacks_by_opp = (BB_KING_ZONE[ksq] & opp_attacks).bit_count()
+    zone_score = max(0, 3 - attacks_by_opp)
+    return shield_score + file_score + zone_score
+
+def board_feature_values(board):
+    black, white = board.occupied_co
+    w_pawns, b_pawns = board.pawns & white, board.pawns & black
+    w_mat = b_mat = 0
+    for piece_type, value in PIECE_VALUES:
+        pieces = board.pieces_mask(piece_type, chess.WHITE), board.pieces_mask(piece_type, chess.BLACK)
+        w_mat += pieces[0].bit_count() * value
+        b_mat += pieces[1].bit_count() * value
+    w_structure = pawn_structure(w_pawns, b_pawns, chess.WHITE)
+    b_structure = pawn_structure(b_pawns, w_pawns, chess.BLACK)
+    rights = board.castling_rights
+    return (
+        w_mat, b_mat, *w_structure, *b_structure,
+        king_safety(board, chess.WHITE, w_pawns, b_pawns, attacks_by(board, chess.BLACK)),
+        king_safety(board, chess.BLACK, b_pawns, w_pawns, attacks_by(board, chess.WHITE)),
+        board.legal_moves.count(),
+        bool(rights & chess.BB_H1), bool(rights & chess.BB_A1),
+        bool(rights & chess.BB_H8), bool(rights & chess.BB_A8)
+    )
+
+def board_features(board):
+    features = dict(zip(BOARD_FEATURES, board_feature_values(board)))
+    features['turn'] = 'w' if board.turn == chess.WHITE else 'b'
+    return features
+
+def extract_features(boards):
+    matrix = np.zeros((len(boards), len(FEATURE_ORDER)), dtype=np.float32)
+    rows = []
+    for board in boards:
+        values = board_feature_values(board)
+        rows.append((*values, board.ply(), board.turn == chess.WHITE, board.halfmove_clock, values[0] - values[1]))
+    if rows: matrix[:, MATRIX_COLUMNS] = np.array(rows, dtype=np.float32)
+    return matrix
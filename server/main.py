@@ -1,10 +1,21 @@
 import os
+import json
+import asyncio
+import hashlib
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
-from redis import Redis
-from rq import Queue
-from build_tree import get_final_json_tree
+from redis import Redis, RedisError, WatchError
+from redis.asyncio import BlockingConnectionPool, Redis as AsyncRedis
+from rq import Queue, Worker
+from rq.job import Job
+from rq.utils import now
+from build_tree import engine_progress_key, get_final_json_tree
+from metrics import render_metrics
+from progress import PROGRESS_KEEPALIVE, progress_key
+from result_store import RESULT_TTL, RedisResultStore, iter_decompressed
 
 class LichessFilters(BaseModel):
     color: str
@@ -20,13 +31,40 @@ class AnalysisRequest(BaseModel):
     p2_filters: LichessFilters
     threshold: float = 0.15
     depth: int = 20
+    transpositions: bool = False
     token: str | None = None
 
 redis_url = os.getenv('REDIS_URL', 'redis://redis:6379')
+ASYNC_REDIS_CONNECTIONS = int(os.getenv('ASYNC_REDIS_CONNECTIONS', 50))
 redis_conn = Redis.from_url(redis_url)
+async_redis = AsyncRedis(connection_pool=BlockingConnectionPool.from_url(redis_url, max_connections=ASYNC_REDIS_CONNECTIONS))
 q = Queue(connection=redis_conn)
-job_results = {}
-app = FastAPI()
+result_store = RedisResultStore(redis_conn)
+JOB_TIMEOUT = 30 * 60
+ANALYSIS_CLAIM_GRACE = 60
+SUBTREE_MAX_DEPTH = 10
+PROGRESS_CHANNEL_PREFIX = progress_key('')
+progress_subscribers = {}
+
+async def listen_progress():
+    while True:
+        pubsub = async_redis.pubsub()
+        try:
+            await pubsub.psubscribe(progress_key('*'))
+            async for message in pubsub.listen():
+                if message["type"] != "pmessage": continue
+                job_id = message["channel"].decode()[len(PROGRESS_CHANNEL_PREFIX):]
+                for queue in progress_subscribers.get(job_id, ()): queue.put_nowait(json.loads(message["data"]))
+        except RedisError: await asyncio.sleep(1)
+        finally: await pubsub.aclose()
+
+@asynccontextmanager
+async def lifespan(app):
+    listener = asyncio.create_task(listen_progress())
+    yield
+    listener.cancel()
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -36,30 +74,187 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+def analysis_key(request):
+    params = request.model_dump(exclude={"token"})
+    params["player1"], params["player2"] = params["player1"].lower(), params["player2"].lower()
+    canonical = json.dumps(params, sort_keys=True, separators=(',', ':'))
+    return f"analysis:job:{hashlib.sha256(canonical.encode()).hexdigest()}"
+
+def aggregate_status(job):
+    aggregate = q.fetch_job(job.meta['aggregate_job']) if 'aggregate_job' in job.meta else None
+    return aggregate.get_status() if aggregate else None
+
+def analysis_pending(job):
+    return aggregate_status(job) in ('deferred', 'scheduled', 'queued', 'started')
+
+def analysis_progress(job):
+    done = redis_conn.get(engine_progress_key(job.id))
+    if done is None: return job.meta.get('progress', 'Analysis in progress...')
+    return f"Analyzing Positions... ({int(done)}/{job.meta.get('engine_positions', '?')} positions)"
+
+def claim_is_stale(job):
+    if job.get_status() in ('failed', 'stopped', 'canceled'): return True
+    if job.enqueued_at is None: return (now() - job.created_at).total_seconds() > ANALYSIS_CLAIM_GRACE
+    return job.is_finished and not result_store.exists(job.id) and not analysis_pending(job)
+
+def release_claim(key, job_id):
+    with redis_conn.pipeline() as pipe:
+        try:
+            pipe.watch(key)
+            if pipe.get(key) != job_id.encode(): return
+            pipe.multi()
+            pipe.delete(key)
+            pipe.execute()
+        except WatchError: pass
+
+def find_analysis_job(key):
+    job_id = redis_conn.get(key)
+    if not job_id: return None
+    job = q.fetch_job(job_id.decode())
+    if job is None or claim_is_stale(job):
+        release_claim(key, job_id.decode())
+        return None
+    return job
+
+def finished_response(result_id, include_result=True, **fields):
+    if not include_result:
+        return {**fields, "status": "finished"} if result_store.exists(result_id) else None
+    chunks = result_store.stream(result_id)
+    if chunks is None: return None
+    prefix = json.dumps({**fields, "status": "finished"})[:-1] + ', "result": '
+    def body():
+        yield prefix.encode()
+        yield from chunks
+        yield b'}'
+    return StreamingResponse(body(), media_type="application/json")
+
 @app.post("/api/analyze")
-async def start_analysis(request: AnalysisRequest):
-    job = q.enqueue(
-        get_final_json_tree,
-        request.player1,
-        request.player2,
-        request.p1_filters.model_dump(),
-        request.p2_filters.model_dump(),
-        request.threshold,
-        request.depth,
-        job_timeout='30m'
-    )
-    return {"message": "Analysis job started", "job_id": job.get_id()}
+def start_analysis(request: AnalysisRequest, result: bool = True):
+    key = analysis_key(request)
+    job = find_analysis_job(key)
+    if job is None:
+        job = q.create_job(
+            get_final_json_tree,
+            args=(
+                request.player1,
+                request.player2,
+                request.p1_filters.model_dump(),
+                request.p2_filters.model_dump(),
+                request.threshold,
+                request.depth,
+            ),
+            kwargs={"transpositions": request.transpositions},
+            timeout=JOB_TIMEOUT,
+            result_ttl=RESULT_TTL
+        )
+        job.save()
+        if redis_conn.set(key, job.id, nx=True, ex=JOB_TIMEOUT + RESULT_TTL):
+            q.enqueue_job(job)
+            return {"message": "Analysis job started", "job_id": job.id}
+        job.delete()
+        job = find_analysis_job(key)
+        if job is None: raise HTTPException(status_code=409, detail="Could not start analysis, please retry.")
+    if job.is_finished:
+        response = finished_response(job.id, result, message="Analysis already finished", job_id=job.id)
+        if response: return response
+    return {"message": "Analysis already in progress", "job_id": job.id}
 
 @app.get("/api/results/{job_id}")
-async def get_status(job_id: str):
+def get_status(job_id: str):
     job = q.fetch_job(job_id)
     if job:
         if job.is_finished:
-            job_results[job_id] = job.result
-            return {"status": "finished", "result": job.result}
+            response = finished_response(job_id)
+            if response: return response
+            if analysis_pending(job): return {"status": "running", "progress": analysis_progress(job)}
+            if aggregate_status(job) in ('failed', 'stopped', 'canceled'): return {"status": "failed"}
+            return {"status": "failed", "error": "Analysis result has expired."}
         elif job.is_failed:
             return {"status": "failed"}
         else:
             progress = job.meta.get('progress', 'Analysis in progress...')
             return {"status": "running", "progress": progress}
-    return {"status": "not_found"}
\ No newline at end of file
+    return {"status": "not_found"}
+
+def load_subtree(job_id, node_id, depth):
+    root = result_store.nodes(job_id, [node_id])[0]
+    level = [root] if root else []
+    while level:
+        ids = [child_id for node in level for child_id in node["children"]] if depth > 0 else []
+        children = dict(zip(ids, result_store.nodes(job_id, ids))) if ids else {}
+        for node in level:
+            node["child_count"] = len(node["children"])
+            node["children"] = [children[child_id] for child_id in node["children"]] if depth > 0 else []
+        level, depth = list(children.values()), depth - 1
+    return root
+
+@app.get("/api/results/{job_id}/subtree")
+def get_subtree(job_id: str, path: str = "", node_id: int | None = None, depth: int = 2):
+    if node_id is None: node_id = result_store.node_id(job_id, ",".join(filter(None, path.split(','))))
+    node = load_subtree(job_id, node_id, max(0, min(depth, SUBTREE_MAX_DEPTH))) if node_id is not None else None
+    if node is None:
+        if not result_store.exists(job_id): raise HTTPException(status_code=404, detail="Analysis result not found.")
+        raise HTTPException(status_code=404, detail="Node not found.")
+    return {"status": "finished", "node": node}
+
+def sse(event): return f"data: {json.dumps(event)}\n\n".encode()
+
+async def job_event(job_id):
+    status = await async_redis.hget(Job.key_for(job_id), 'status')
+    if status is None: return {"status": "not_found"}
+    if status == b'finished':
+        if await async_redis.exists(result_store.key(job_id)): return {"status": "finished"}
+        last = await async_redis.get(progress_key(job_id))
+        event = json.loads(last) if last else {"status": "finished"}
+        if event["status"] == "running": return None
+        if event["status"] == "failed": return event
+        return {"status": "failed", "error": "Analysis result has expired."}
+    if status in (b'failed', b'stopped', b'canceled'): return {"status": "failed"}
+    return None
+
+async def progress_events(job_id, include_result=True):
+    queue = asyncio.Queue()
+    progress_subscribers.setdefault(job_id, set()).add(queue)
+    try:
+        event = await job_event(job_id)
+        if event is None:
+            last = await async_redis.get(progress_key(job_id))
+            event = json.loads(last) if last else {"status": "running", "progress": "Analysis in progress..."}
+        while True:
+            if event["status"] == "finished":
+                if not include_result and await async_redis.exists(result_store.key(job_id)):
+                    yield sse({"status": "finished"})
+                    return
+                blob = await async_redis.get(result_store.key(job_id))
+                if blob is None:
+                    yield sse({"status": "failed", "error": "Analysis result has expired."})
+                    return
+                yield b'data: {"status": "finished", "result": '
+                for chunk in iter_decompressed(blob): yield chunk
+                yield b'}\n\n'
+                return
+            yield sse(event)
+            if event["status"] != "running": return
+            event = None
+            while event is None:
+                try: event = await asyncio.wait_for(queue.get(), PROGRESS_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    event = await job_event(job_id)
+                    if event is None: yield b": keepalive\n\n"
+    finally:
+        progress_subscribers[job_id].discard(queue)
+        if not progress_subscribers[job_id]: del progress_subscribers[job_id]
+
+@app.get("/api/results/{job_id}/events")
+async def stream_progress(job_id: str, result: bool = True):
+    return StreamingResponse(progress_events(job_id, result), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.get("/metrics")
+def get_metrics():
+    gauges = {
+        "queue_depth": ("Analysis jobs waiting in the queue.", q.count),
+        "jobs_running": ("Analysis jobs currently being processed.", q.started_job_registry.count),
+        "workers": ("Workers connected to Redis.", Worker.count(connection=redis_conn)),
+    }
+    return PlainTextResponse(render_metrics(redis_conn, gauges), media_type="text/plain; version=0.0.4")
\ No newline at end of file
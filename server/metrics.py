@@ -0,0 +1,101 @@
+import threading
+import time
+from contextlib import contextmanager
+
+METRICS_PREFIX = 'metrics'
+METRICS_NAMESPACE = 'opening_prep'
+PHASES = ('startup', 'ingest', 'intersect', 'engine', 'inference', 'store')
+TOTALS = ('games', 'tree_nodes', 'intersected_nodes', 'engine_positions', 'inference_rows', 'result_bytes')
+DURATION_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+def reset_peak_rss():
+    try:
+        with open('/proc/self/clear_refs', 'w') as fp: fp.write('5')
+        return True
+    except OSError: return False
+
+def peak_rss_mb():
+    with open('/proc/self/status') as fp:
+        for line in fp:
+            if line.startswith('VmHWM:'): return int(line.split()[1]) / 1024
+    return 0
+
+class JobMetrics:
+    def __init__(self, track_memory=False):
+        self.lock = threading.Lock()
+        self.values = {}
+        self.track_memory = track_memory
+
+    def add(self, name, amount=1):
+        with self.lock: self.values[name] = self.values.get(name, 0) + amount
+
+    def peak(self, name, value):
+        with self.lock: self.values[name] = max(self.values.get(name, 0), value)
+
+    @contextmanager
+    def phase(self, name):
+        tracking = self.track_memory and reset_peak_rss()
+        start = time.perf_counter()
+        try: yield
+        finally:
+            self.add(f"{name}_seconds", time.perf_counter() - start)
+            if tracking: self.peak(f"{name}_peak_rss_mb", peak_rss_mb())
+
+    def summary(self):
+        with self.lock: values = dict(self.values)
+        for rate, count, seconds in (('games_per_second', 'games', 'ingest_seconds'),
+                                     ('inference_rows_per_second', 'inference_rows', 'inference_seconds')):
+            if values.get(seconds): values[rate] = values.get(count, 0) / values[seconds]
+        return values
+
+def observe(pipe, key, value):
+    for bound in DURATION_BUCKETS:
+        if value <= bound: pipe.hincrby(key, str(bound), 1)
+    pipe.hincrby(key, '+Inf', 1)
+    pipe.hincrbyfloat(key, 'sum', value)
+
+def record_job(connection, values, status):
+    pipe = connection.pipeline()
+    pipe.hincrby(f"{METRICS_PREFIX}:jobs", status, 1)
+    for name in TOTALS:
+        if name in values: pipe.hincrbyfloat(f"{METRICS_PREFIX}:totals", name, values[name])
+    for phase in ('job', *PHASES):
+        seconds = values.get(f"{phase}_seconds")
+        if seconds is not None: observe(pipe, f"{METRICS_PREFIX}:duration:{phase}", seconds)
+    pipe.execute()
+
+def as_str(value):
+    return value.decode() if isinstance(value, bytes) else value
+
+def histogram_lines(name, counts, labels=''):
+    counts = {as_str(key): float(value) for key, value in counts.items()}
+    lines = [f'{name}_bucket{{{labels}le="{bound}"}} {counts.get(str(bound), 0):g}' for bound in DURATION_BUCKETS]
+    lines.append(f'{name}_bucket{{{labels}le="+Inf"}} {counts.get("+Inf", 0):g}')
+    labels = f"{{{labels.rstrip(',')}}}" if labels else ''
+    lines.append(f'{name}_sum{labels} {counts.get("sum", 0):g}')
+    lines.append(f'{name}_count{labels} {counts.get("+Inf", 0):g}')
+    return lines
+
+def render_metrics(connection, gauges):
+    lines = []
+    for name, (description, value) in gauges.items():
+        lines += [f"# HELP {METRICS_NAMESPACE}_{name} {description}", f"# TYPE {METRICS_NAMESPACE}_{name} gauge",
+                  f"{METRICS_NAMESPACE}_{name} {value:g}"]
+    jobs = connection.hgetall(f"{METRICS_PREFIX}:jobs")
+    lines += [f"# HELP {METRICS_NAMESPACE}_jobs_total Analysis jobs completed by the workers.",
+              f"# TYPE {METRICS_NAMESPACE}_jobs_total counter"]
+    lines += [f'{METRICS_NAMESPACE}_jobs_total{{status="{as_str(status)}"}} {int(count)}' for status, count in jobs.items()]
+    totals = {as_str(name): float(value) for name, value in connection.hgetall(f"{METRICS_PREFIX}:totals").items()}
+    for name in TOTALS:
+        lines += [f"# HELP {METRICS_NAMESPACE}_{name}_total Sum of {name.replace('_', ' ')} over all jobs.",
+                  f"# TYPE {METRICS_NAMESPACE}_{name}_total counter",
+                  f"{METRICS_NAMESPACE}_{name}_total {totals.get(name, 0):g}"]
+    lines += [f"# HELP {METRICS_NAMESPACE}_job_duration_seconds Wall time of analysis jobs.",
+              f"# TYPE {METRICS_NAMESPACE}_job_duration_seconds histogram"]
+    lines += histogram_lines(f"{METRICS_NAMESPACE}_job_duration_seconds", connection.hgetall(f"{METRICS_PREFIX}:duration:job"))
+    lines += [f"# HELP {METRICS_NAMESPACE}_phase_duration_seconds Wall time of each analysis phase.",
+              f"# TYPE {METRICS_NAMESPACE}_phase_duration_seconds histogram"]
+    for phase in PHASES:
+        counts = connection.hgetall(f"{METRICS_PREFIX}:duration:{phase}")
+        lines += histogram_lines(f"{METRICS_NAMESPACE}_phase_duration_seconds", counts, f'phase="{phase}",')
+    return "\n".join(lines) + "\n"
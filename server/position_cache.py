@@ -0,0 +1,112 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+SCRIPT_DIR = os.path.dirname(os.path.realpath(__file__))
+POSITION_CACHE_BACKEND = os.getenv('POSITION_CACHE', 'sqlite')
+POSITION_CACHE_PATH = os.getenv('POSITION_CACHE_PATH', os.path.join(SCRIPT_DIR, 'position_cache.sqlite'))
+POSITION_CACHE_SIZE = int(os.getenv('POSITION_CACHE_SIZE', 200000))
+
+def normalize_fen(fen):
+    return " ".join(fen.split()[:4])
+
+def position_key(fen):
+    return normalize_fen(fen)
+
+class PositionCache:
+    def __init__(self, max_size=POSITION_CACHE_SIZE):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, keys):
+        keys = list(dict.fromkeys(keys))
+        found = self.fetch(keys) if keys else {}
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+
+    def set_many(self, items):
+        if items: self.store(items)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / lookups if lookups else 0}
+
+    def fetch(self, keys): raise NotImplementedError
+
+    def store(self, items): raise NotImplementedError
+
+    def close(self): pass
+
+class SQLitePositionCache(PositionCache):
+    def __init__(self, path=POSITION_CACHE_PATH, max_size=POSITION_CACHE_SIZE):
+        super().__init__(max_size)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS positions (key TEXT PRIMARY KEY, value TEXT, accessed REAL)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS positions_accessed ON positions (accessed)")
+        self.conn.commit()
+
+    def fetch(self, keys):
+        found, now = {}, time.time()
+        with self.lock:
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i+500]
+                marks = ",".join("?" * len(chunk))
+                rows = self.conn.execute(f"SELECT key, value FROM positions WHERE key IN ({marks})", chunk)
+                found.update((key, json.loads(value)) for key, value in rows)
+                self.conn.execute(f"UPDATE positions SET accessed = ? WHERE key IN ({marks})", [now, *chunk])
+            self.conn.commit()
+        return found
+
+    def store(self, items):
+        now = time.time()
+        with self.lock:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO positions (key, value, accessed) VALUES (?, ?, ?)",
+                [(key, json.dumps(value), now) for key, value in items.items()]
+            )
+            size = self.conn.execute("SELECT COUNT(*) FROM positions").fetchone()[0]
+            if size > self.max_size:
+                self.conn.execute(
+                    "DELETE FROM positions WHERE key IN (SELECT key FROM positions ORDER BY accessed LIMIT ?)",
+                    (size - self.max_size,)
+                )
+            self.conn.commit()
+
+    def close(self):
+        with self.lock: self.conn.close()
+
+class RedisPositionCache(PositionCache):
+    def __init__(self, connection, max_size=POSITION_CACHE_SIZE, prefix='poscache'):
+        super().__init__(max_size)
+        self.conn = connection
+        self.prefix = prefix
+        self.lru_key = f"{prefix}:lru"
+
+    def fetch(self, keys):
+        values = self.conn.mget([f"{self.prefix}:{key}" for key in keys])
+        found = {key: json.loads(value) for key, value in zip(keys, values) if value is not None}
+        if found: self.conn.zadd(self.lru_key, {key: time.time() for key in found})
+        return found
+
+    def store(self, items):
+        now = time.time()
+        pipe = self.conn.pipeline()
+        for key, value in items.items(): pipe.set(f"{self.prefix}:{key}", json.dumps(value))
+        pipe.zadd(self.lru_key, {key: now for key in items})
+        pipe.zcard(self.lru_key)
+        size = pipe.execute()[-1]
+        if size > self.max_size:
+            evicted = [key.decode() if isinstance(key, bytes) else key
+                       for key, _ in self.conn.zpopmin(self.lru_key, size - self.max_size)]
+            if evicted: self.conn.delete(*(f"{self.prefix}:{key}" for key in evicted))
+
+def get_position_cache(backend=POSITION_CACHE_BACKEND, connection=None):
+    if backend == 'sqlite': return SQLitePositionCache()
+    if backend == 'redis' and connection is not None: return RedisPositionCache(connection)
+    return None
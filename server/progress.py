@@ -0,0 +1,14 @@
+import json
+import os
+
+PROGRESS_TTL = int(os.getenv('PROGRESS_TTL', 60 * 60))
+PROGRESS_KEEPALIVE = int(os.getenv('PROGRESS_KEEPALIVE', 15))
+
+def progress_key(job_id): return f"analysis:progress:{job_id}"
+
+def publish_progress(connection, job_id, status, **fields):
+    event = json.dumps({"status": status, **fields})
+    pipe = connection.pipeline()
+    pipe.set(progress_key(job_id), event, ex=PROGRESS_TTL)
+    pipe.publish(progress_key(job_id), event)
+    pipe.execute()
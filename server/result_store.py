@@ -0,0 +1,163 @@
+import gzip
+import json
+import os
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+RESULT_TTL = int(os.getenv('RESULT_TTL', 60 * 60))
+RESULT_STORE_MAX_BYTES = int(os.getenv('RESULT_STORE_MAX_BYTES', 256 * 1024 * 1024))
+RESULT_CHUNK_SIZE = 64 * 1024
+
+def compress_result(result):
+    return gzip.compress(json.dumps(result, separators=(',', ':')).encode(), compresslevel=6)
+
+def iter_decompressed(blob, chunk_size=RESULT_CHUNK_SIZE):
+    decompressor = zlib.decompressobj(wbits=31)
+    for i in range(0, len(blob), chunk_size):
+        chunk = decompressor.decompress(blob[i:i+chunk_size])
+        if chunk: yield chunk
+    tail = decompressor.flush()
+    if tail: yield tail
+
+def index_result(result):
+    nodes, paths = {}, {}
+    def index(node, path):
+        record = {key: value for key, value in node.items() if key != "children"}
+        record["id"], record["path"] = len(nodes), path
+        nodes[record["id"]], paths[",".join(path)] = record, record["id"]
+        record["children"] = [index(child, path + [child["san"]]) for child in node["children"]]
+        return record["id"]
+    index(result, [])
+    return {node_id: json.dumps(record, separators=(',', ':')) for node_id, record in nodes.items()}, paths
+
+def as_str(value):
+    return value.decode() if isinstance(value, bytes) else value
+
+class ResultStore:
+    def put(self, job_id, result):
+        blob = compress_result(result)
+        self.store(job_id, blob, *index_result(result))
+        return len(blob)
+
+    def stream(self, job_id):
+        blob = self.get(job_id)
+        return iter_decompressed(blob) if blob is not None else None
+
+    def load(self, job_id):
+        blob = self.get(job_id)
+        return json.loads(gzip.decompress(blob)) if blob is not None else None
+
+    def exists(self, job_id): return self.get(job_id) is not None
+
+    def store(self, job_id, blob, nodes, paths): raise NotImplementedError
+
+    def get(self, job_id): raise NotImplementedError
+
+    def node_id(self, job_id, path): raise NotImplementedError
+
+    def nodes(self, job_id, node_ids): raise NotImplementedError
+
+class RedisResultStore(ResultStore):
+    def __init__(self, connection, ttl=RESULT_TTL, max_bytes=RESULT_STORE_MAX_BYTES, prefix='analysis:result'):
+        self.conn = connection
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.prefix = prefix
+        self.index_key = f"{prefix}:index"
+        self.sizes_key = f"{prefix}:sizes"
+
+    def key(self, job_id): return f"{self.prefix}:{job_id}"
+
+    def nodes_key(self, job_id): return f"{self.prefix}:{job_id}:nodes"
+
+    def paths_key(self, job_id): return f"{self.prefix}:{job_id}:paths"
+
+    def store(self, job_id, blob, nodes, paths):
+        now = time.time()
+        size = len(blob) + sum(map(len, nodes.values())) + sum(map(len, paths))
+        pipe = self.conn.pipeline()
+        pipe.set(self.key(job_id), blob, ex=self.ttl)
+        pipe.hset(self.nodes_key(job_id), mapping=nodes)
+        pipe.hset(self.paths_key(job_id), mapping=paths)
+        pipe.expire(self.nodes_key(job_id), self.ttl)
+        pipe.expire(self.paths_key(job_id), self.ttl)
+        pipe.zadd(self.index_key, {job_id: now + self.ttl})
+        pipe.hset(self.sizes_key, job_id, size)
+        pipe.execute()
+        self.evict(now)
+
+    def get(self, job_id): return self.conn.get(self.key(job_id))
+
+    def node_id(self, job_id, path):
+        node_id = self.conn.hget(self.paths_key(job_id), path)
+        return int(node_id) if node_id is not None else None
+
+    def nodes(self, job_id, node_ids):
+        return [json.loads(node) if node else None for node in self.conn.hmget(self.nodes_key(job_id), node_ids)]
+
+    def exists(self, job_id): return bool(self.conn.exists(self.key(job_id)))
+
+    def evict(self, now):
+        expired = [as_str(job_id) for job_id in self.conn.zrangebyscore(self.index_key, '-inf', now)]
+        if expired: self.forget(expired)
+        sizes = {as_str(job_id): int(size) for job_id, size in self.conn.hgetall(self.sizes_key).items()}
+        total, evicted = sum(sizes.values()), []
+        for job_id in map(as_str, self.conn.zrange(self.index_key, 0, -1)):
+            if total <= self.max_bytes: break
+            total -= sizes.get(job_id, 0)
+            evicted.append(job_id)
+        if evicted: self.forget(evicted)
+
+    def forget(self, job_ids):
+        pipe = self.conn.pipeline()
+        pipe.delete(*(key for job_id in job_ids
+                      for key in (self.key(job_id), self.nodes_key(job_id), self.paths_key(job_id))))
+        pipe.zrem(self.index_key, *job_ids)
+        pipe.hdel(self.sizes_key, *job_ids)
+        pipe.execute()
+
+class MemoryResultStore(ResultStore):
+    def __init__(self, ttl=RESULT_TTL, max_bytes=RESULT_STORE_MAX_BYTES):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.results = OrderedDict()
+        self.total = 0
+
+    def store(self, job_id, blob, nodes, paths):
+        with self.lock:
+            self.drop(job_id)
+            self.results[job_id] = (time.time() + self.ttl, blob, nodes, paths)
+            self.total += len(blob)
+            while self.total > self.max_bytes and self.results: self.drop(next(iter(self.results)))
+
+    def entry(self, job_id):
+        with self.lock:
+            entry = self.results.get(job_id)
+            if entry and entry[0] < time.time():
+                self.drop(job_id)
+                return None
+            return entry
+
+    def get(self, job_id):
+        entry = self.entry(job_id)
+        return entry[1] if entry else None
+
+    def node_id(self, job_id, path):
+        entry = self.entry(job_id)
+        return entry[3].get(path) if entry else None
+
+    def nodes(self, job_id, node_ids):
+        entry = self.entry(job_id)
+        if not entry: return [None] * len(node_ids)
+        return [json.loads(entry[2][node_id]) if node_id in entry[2] else None for node_id in node_ids]
+
+    def drop(self, job_id):
+        entry = self.results.pop(job_id, None)
+        if entry: self.total -= len(entry[1])
+
+def get_result_store(connection=None):
+    if connection is not None: return RedisResultStore(connection)
+    return MemoryResultStore()
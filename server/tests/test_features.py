@@ -0,0 +1,33 @@
+import chess
+import numpy as np
+from features import BOARD_FEATURES, FEATURE_ORDER, board_feature_values, extract_features
+from benchmarks.bench_features import collect_boards, reference_values
+from benchmarks.fixtures import synthetic_games
+
+EDGE_FENS = [
+    'r3k2r/pppq1ppp/2npbn2/4p3/4P3/2NPBN2/PPPQ1PPP/R3K2R w KQkq - 4 9',
+    'rnbqkbnr/ppp1p1pp/8/3pPp2/8/8/PPPP1PPP/RNBQKBNR w KQkq f6 0 3',
+    '8/P6k/8/8/8/8/6Kp/8 w - - 0 60',
+    '7k/5Q2/6K1/8/8/8/8/8 b - - 0 70',
+    '4k3/pp3ppp/8/2P5/P7/8/5PPP/4K3 b - - 0 30',
+]
+BOARDS = collect_boards(synthetic_games(100), 60) + [chess.Board(fen) for fen in EDGE_FENS]
+
+def test_board_feature_values_match_reference():
+    mismatches = [board.fen() for board in BOARDS if board_feature_values(board) != reference_values(board)]
+    assert not mismatches
+
+def test_extract_features_matches_reference():
+    matrix = extract_features(BOARDS)
+    assert matrix.shape == (len(BOARDS), len(FEATURE_ORDER))
+    expected = np.zeros_like(matrix)
+    for i, board in enumerate(BOARDS):
+        values = dict(zip(BOARD_FEATURES, reference_values(board)))
+        values['ply_number'], values['halfmove_clock'] = board.ply(), board.halfmove_clock
+        values['is_white_turn'] = board.turn == chess.WHITE
+        values['material_diff'] = values['white_material'] - values['black_material']
+        for feature, value in values.items(): expected[i, FEATURE_ORDER.index(feature)] = value
+    np.testing.assert_array_equal(matrix, expected)
+
+def test_extract_features_empty():
+    assert extract_features([]).shape == (0, len(FEATURE_ORDER))
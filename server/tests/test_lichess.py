@@ -0,0 +1,89 @@
+import os
+import re
+import socket
+import threading
+from datetime import datetime, timezone
+from http.server import ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import pytest
+import requests
+import build_tree
+from build_tree import GAME_SEPARATOR, HEADER_RE, game_timestamp, get_game_stream, get_player_tree, resume_game_stream
+from benchmarks.fixtures import START_TIMESTAMP, synthetic_games
+from benchmarks.lichess_stub import GameLibrary, LichessHandler, iter_export
+from metrics import JobMetrics
+from tree_store import TreeStore
+
+PLAYER = "alice"
+
+class DroppingHandler(LichessHandler):
+    def do_GET(self):
+        query = {key: values[-1] for key, values in parse_qs(urlparse(self.path).query).items()}
+        self.server.queries.append(query)
+        action = self.server.actions.pop(0) if self.server.actions else None
+        if action is None: return super().do_GET()
+        if action == 'missing': return self.send_error(404)
+        data = b''.join(iter_export(self.server.library.get(PLAYER), PLAYER, query))[:action]
+        self.send_response(200)
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+        self.connection.shutdown(socket.SHUT_RDWR)
+        self.close_connection = True
+
+def same_second_games(n, per_second=3):
+    games = []
+    for i, pgn in enumerate(synthetic_games(n)):
+        played = datetime.fromtimestamp(START_TIMESTAMP + i // per_second * 600, timezone.utc)
+        pgn = re.sub(r'\[UTCDate "[^"]*"\]', f'[UTCDate "{played:%Y.%m.%d}"]', pgn)
+        pgn = re.sub(r'\[UTCTime "[^"]*"\]', f'[UTCTime "{played:%H:%M:%S}"]', pgn)
+        games.append((dict(HEADER_RE.findall(pgn)), pgn))
+    games.sort(key=lambda game: game_timestamp(game[0]), reverse=True)
+    return games
+
+@pytest.fixture
+def stub(monkeypatch):
+    library = GameLibrary()
+    library.games[PLAYER] = same_second_games(30)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), DroppingHandler)
+    server.daemon_threads = True
+    server.library, server.queries, server.actions = library, [], []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(build_tree, 'LICHESS_URL', f"http://127.0.0.1:{server.server_port}")
+    monkeypatch.setattr(build_tree.time, 'sleep', lambda seconds: None)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def cut_after(games, count):
+    data = b''.join(pgn.encode() + GAME_SEPARATOR for _, pgn in games)
+    end = 0
+    for _ in range(count): end = data.index(GAME_SEPARATOR, end) + len(GAME_SEPARATOR)
+    return end + 40
+
+def test_resume_skips_games_already_sent_in_the_same_second(stub):
+    games = stub.library.games[PLAYER]
+    stub.actions = [cut_after(games, 7)]
+    metrics = JobMetrics()
+    stream = get_game_stream(PLAYER, {'max': 20}, None)
+    received = list(resume_game_stream(stream, PLAYER, {'max': 20}, None, metrics=metrics))
+    assert received == [pgn for _, pgn in games[:20]]
+    assert metrics.values['stream_resumes'] == 1
+    resume = stub.queries[1]
+    assert int(resume['until']) == game_timestamp(games[6][0]) + 999
+    assert int(resume['max']) == 20 - 7 + 1
+
+def test_resume_gives_up_after_repeated_drops(stub):
+    stub.actions = [cut_after(stub.library.games[PLAYER], 2)] * 3
+    stream = get_game_stream(PLAYER, {}, None)
+    with pytest.raises(requests.RequestException):
+        list(resume_game_stream(stream, PLAYER, {}, None, retries=2))
+    assert len(stub.queries) == 3
+
+def test_failed_resume_fails_the_tree_without_saving(stub, tmp_path):
+    stub.actions = [cut_after(stub.library.games[PLAYER], 4), 'missing']
+    store = TreeStore(str(tmp_path))
+    with pytest.raises(requests.ConnectionError, match="Could not resume"):
+        get_player_tree(PLAYER, {'max': 20}, 8, None, store)
+    assert not [name for name in os.listdir(tmp_path) if name.endswith('.pickle')]
@@ -0,0 +1,82 @@
+import chess
+from build_tree import (GAME_SEPARATOR, ChessNode, START_FEN, add_game_to_tree, add_pgn_to_tree, pgn_file_generator,
+                        read_pgn_moves, split_pgn_games)
+from benchmarks.fixtures import synthetic_games
+
+HEADERS = '''[Event "Rated Blitz game"]
+[Site "https://lichess.org/{site}"]
+[White "Alice"]
+[Black "Bob"]
+[Result "{result}"]
+[UTCDate "2024.01.01"]
+[UTCTime "12:00:00"]
+[WhiteElo "1500"]
+[BlackElo "1600"]
+[TimeControl "180+2"]
+'''
+ANNOTATED = HEADERS.format(site="annotated", result="1-0") + '''
+1. e4 { [%eval 0.3] [%clk 0:03:00] } 1... e5?! $6 { [%eval 0.42] [%clk 0:02:58.5] } 2. Nf3! $1 (2. f4 exf4 (2... d5) 3. Nf3 { [%clk 0:01:00] }) 2... Nc6 { [%clk 0:02:55] }
+3. Bb5 { a comment } 3... a6 { [%eval #-3] [%clk 0:02:49] } ; rest of line
+4. Bxc6 dxc6 5. O-O { [%clk 0:02:40] } 1-0'''
+UNCLOCKED = HEADERS.format(site="unclocked", result="1/2-1/2") + '''
+1. d4 d5 2. c4 e6 3. Nc3 Nf6 1/2-1/2'''
+FROM_POSITION = HEADERS.format(site="fen", result="0-1").replace(
+    '[TimeControl', '[SetUp "1"]\n[FEN "4k3/8/8/8/8/8/4P3/4K3 w - - 0 1"]\n[TimeControl') + '''
+1. e4 { [%clk 0:03:00] } 1... Kd7 { [%clk 0:03:00] } 0-1'''
+
+def build(add, games, depth):
+    tree = ChessNode(START_FEN, 'root', 'root')
+    for pgn in games: add(tree, pgn, depth)
+    return tree
+
+def assert_same_tree(a, b):
+    assert (a.fen, a.uci, a.res, a.occ.data.tobytes()) == (b.fen, b.uci, b.res, b.occ.data.tobytes()), a.san
+    assert list(a.children) == list(b.children), a.san
+    for san in a.children: assert_same_tree(a.children[san], b.children[san])
+
+def test_read_pgn_moves_skips_annotations():
+    headers, moves = read_pgn_moves(ANNOTATED, 100)
+    assert headers['Site'] == 'https://lichess.org/annotated'
+    assert moves == [['e4', 180.0], ['e5', 178.5], ['Nf3', None], ['Nc6', 175.0], ['Bb5', None], ['a6', 169.0],
+                     ['Bxc6', None], ['dxc6', None], ['O-O', 160.0]]
+    assert read_pgn_moves(ANNOTATED, 3)[1] == moves[:3]
+
+def test_add_pgn_to_tree_matches_chess_pgn():
+    games = synthetic_games(50) + [ANNOTATED, UNCLOCKED, FROM_POSITION]
+    for depth in (1, 8, 100):
+        assert_same_tree(build(add_pgn_to_tree, games, depth), build(add_game_to_tree, games, depth))
+
+def test_add_pgn_to_tree_replays_fen_games_from_their_position():
+    tree = build(add_pgn_to_tree, [FROM_POSITION], 10)
+    reply = tree.children['e4'].children['Kd7']
+    assert chess.Board(reply.fen).board_fen() == '8/3k4/8/8/4P3/8/8/4K3'
+    assert reply.res == {'w_wins': 0, 'b_wins': 1, 'draws': 0}
+
+def test_add_pgn_to_tree_returns_timestamp():
+    assert add_pgn_to_tree(ChessNode(START_FEN, 'root', 'root'), ANNOTATED, 10) == 1704110400000
+    assert add_pgn_to_tree(ChessNode(START_FEN, 'root', 'root'), '', 10) == 0
+
+def chunked(data, size): return (data[i:i+size] for i in range(0, len(data), size))
+
+def test_split_pgn_games_across_chunk_boundaries():
+    games = synthetic_games(20)
+    assert any(not game.isascii() for game in games)
+    data = GAME_SEPARATOR.join(game.encode() for game in games) + GAME_SEPARATOR
+    for size in (1, 2, 3, 7, 64, len(data)):
+        assert list(split_pgn_games(chunked(data, size))) == games
+
+def test_split_pgn_games_trailing_game_and_empty_games():
+    data = GAME_SEPARATOR + b"first" + GAME_SEPARATOR * 2 + b"\n\nsecond\n"
+    for size in (1, 4, len(data)):
+        assert list(split_pgn_games(chunked(data, size))) == ["first", "second"]
+    assert list(split_pgn_games([])) == []
+
+def test_pgn_file_generator_mmap(tmp_path):
+    games = synthetic_games(10)
+    path = tmp_path / "games.pgn"
+    path.write_bytes(GAME_SEPARATOR.join(game.encode() for game in games))
+    for use_mmap in (False, True):
+        assert list(pgn_file_generator(path, chunk_size=5, use_mmap=use_mmap)) == games
+    empty = tmp_path / "empty.pgn"
+    empty.write_bytes(b"")
+    assert list(pgn_file_generator(empty, use_mmap=True)) == []
@@ -0,0 +1,59 @@
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+
+SCRIPT_DIR = os.path.dirname(os.path.realpath(__file__))
+TREE_STORE_BACKEND = os.getenv('TREE_STORE', 'disk')
+TREE_STORE_PATH = os.getenv('TREE_STORE_PATH', os.path.join(SCRIPT_DIR, 'tree_store'))
+TREE_STORE_MAX_BYTES = int(os.getenv('TREE_STORE_MAX_BYTES', 2 * 1024 * 1024 * 1024))
+TREE_STORE_VERSION = 4
+
+class TreeStore:
+    def __init__(self, path=TREE_STORE_PATH, max_bytes=TREE_STORE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        os.makedirs(path, exist_ok=True)
+
+    def key(self, player, filters, depth):
+        spec = {"player": player.lower(), "filters": filters, "depth": depth, "version": TREE_STORE_VERSION}
+        spec = json.dumps(spec, sort_keys=True)
+        return hashlib.sha1(spec.encode()).hexdigest()
+
+    def snapshot_path(self, player, filters, depth):
+        return os.path.join(self.path, f"{self.key(player, filters, depth)}.pickle")
+
+    def load(self, player, filters, depth):
+        path = self.snapshot_path(player, filters, depth)
+        try:
+            with open(path, 'rb') as fp:
+                snapshot = pickle.load(fp)
+            os.utime(path)
+            return snapshot["tree"], snapshot["newest"], snapshot["games"]
+        except (OSError, pickle.UnpicklingError, EOFError, KeyError): return None, 0, []
+
+    def save(self, player, filters, depth, tree, newest, games):
+        fd, tmp_path = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as fp:
+            pickle.dump({"tree": tree, "newest": newest, "games": games}, fp, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.snapshot_path(player, filters, depth))
+        self.evict()
+
+    def evict(self):
+        snapshots = []
+        for entry in os.scandir(self.path):
+            if not entry.name.endswith('.pickle'): continue
+            try: stat = entry.stat()
+            except OSError: continue
+            snapshots.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in snapshots)
+        for _, size, path in sorted(snapshots):
+            if total <= self.max_bytes: break
+            try: os.remove(path)
+            except FileNotFoundError: pass
+            total -= size
+
+def get_tree_store(backend=TREE_STORE_BACKEND):
+    if backend == 'disk': return TreeStore()
+    return None
@@ -1,13 +1,29 @@
 import os
+import time
 from redis import Redis
-from rq import Worker, Queue
+from rq import Worker, SimpleWorker, Queue
+from build_tree import WORKER_MODE, get_engine_pool, get_onnx_session
 
 listen = ['default']
 redis_url = os.getenv('REDIS_URL', 'redis://redis:6379')
 redis_conn = Redis.from_url(redis_url)
 
+def warm_up():
+    start = time.perf_counter()
+    get_onnx_session()
+    loaded = time.perf_counter()
+    pool = get_engine_pool()
+    ready = time.perf_counter()
+    print(f"Warm worker: ONNX session {loaded - start:.2f}s, {pool.size} engines {ready - loaded:.2f}s saved per job")
+
 if __name__ == '__main__':
     queues = [Queue(name, connection=redis_conn) for name in listen]
-    worker = Worker(queues, connection=redis_conn)
-    print(f"Worker started. Listening on queue: {listen[0]}")
-    worker.work()
\ No newline at end of file
+    if WORKER_MODE == 'warm':
+        warm_up()
+        worker = SimpleWorker(queues, connection=redis_conn)
+    else:
+        worker = Worker(queues, connection=redis_conn)
+    print(f"Worker started ({WORKER_MODE}). Listening on queue: {listen[0]}")
+    try: worker.work()
+    finally:
+        if WORKER_MODE == 'warm': get_engine_pool().close()